@@ -0,0 +1,69 @@
+"""Compare two reports of benchmarks.hot_paths, and fail if any of the
+benchmarks got slower than the given threshold."""
+
+import json
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+DEFAULT_THRESHOLD = 1.2
+
+Key = Tuple[str, int, int, int]
+
+
+def load_results(path: Path) -> Dict[Key, Dict[str, Any]]:
+    report = json.loads(path.read_text())
+    return {
+        (
+            result["benchmark"],
+            result["stores"],
+            result["days"],
+            result["products"],
+        ): result
+        for result in report["results"]
+    }
+
+
+def compare(
+    baseline: Path, candidate: Path, *, threshold: float = DEFAULT_THRESHOLD
+) -> List[Tuple[Key, float, float, float]]:
+    """Return the (key, baseline, candidate, ratio) of the regressions,
+    using the fastest run of each benchmark."""
+    baseline_results = load_results(baseline)
+    candidate_results = load_results(candidate)
+
+    regressions = []
+    for key, result in sorted(candidate_results.items()):
+        if key not in baseline_results:
+            continue
+
+        before = baseline_results[key]["min"]
+        after = result["min"]
+        ratio = after / before if before else float("inf")
+        print(
+            f"{key[0]:<35} {key[2]:>5}d x {key[3]:>6}p"
+            f" {before:10.4f}s -> {after:10.4f}s ({ratio:5.2f}x)"
+        )
+        if ratio > threshold:
+            regressions.append((key, before, after, ratio))
+    return regressions
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    options = parser.parse_args()
+    regressions = compare(
+        options.baseline, options.candidate, threshold=options.threshold
+    )
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {options.threshold}x")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
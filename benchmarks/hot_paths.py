@@ -0,0 +1,287 @@
+"""Time the format and the analysis hot paths on growing synthetic
+datastores, and report the results as JSON (see benchmarks.compare)."""
+
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, cast
+
+from benchmarks.synthetic import generate_stores
+from inflate.changes import find_price_changes
+from inflate.format import Collection, DatedCollections, MergedCollection
+from inflate.matrix import PriceMatrix
+
+# The analysis tool wants the GitHub credentials as soon as it is
+# imported (and caches the requests outside of production), none of
+# which are needed for running the analyzers on local data.
+os.environ.setdefault("GITHUB_USER", "benchmarks")
+os.environ.setdefault("GITHUB_TOKEN", "benchmarks")
+os.environ.setdefault("PRODUCTION", "1")
+
+from inflate.tools.analyze import ANALYZERS  # noqa: E402
+
+Stores = Dict[str, DatedCollections]
+Benchmark = Callable[[Stores], Callable[[], Any]]
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+DEFAULT_DAYS = [30, 90, 365]
+DEFAULT_PRODUCTS = [500, 2_000]
+DEFAULT_STORES = 2
+DEFAULT_REPEAT = 3
+
+ANALYZER_ARGS: Dict[str, Dict[str, Any]] = {
+    "price_changes": {"kind": "all"},
+}
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    """Register a benchmark. Each benchmark prepares its inputs from the
+    synthetic stores, and returns the function to time."""
+
+    def register(func: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+def merge_stores(stores: Stores) -> List[MergedCollection]:
+    return [
+        MergedCollection.from_collections(name, dated_collections)
+        for name, dated_collections in stores.items()
+    ]
+
+
+@benchmark("collection.post_init")
+def bench_post_init(stores: Stores) -> Callable[[], Any]:
+    # The duplicates are already eliminated in the synthetic collections,
+    # so start from the raw (scraped) items instead.
+    raw_items = [
+        (collection.name, list(collection.items) * 2)
+        for dated_collections in stores.values()
+        for collection in dated_collections.values()
+    ]
+    return lambda: [Collection(name, items) for name, items in raw_items]
+
+
+@benchmark("collection.eliminate_duplicates")
+def bench_eliminate_duplicates(stores: Stores) -> Callable[[], Any]:
+    collections = [
+        (collection, list(collection.items) * 2)
+        for dated_collections in stores.values()
+        for collection in dated_collections.values()
+    ]
+
+    def run() -> None:
+        for collection, items in collections:
+            collection.items = items
+            collection.eliminate_duplicates()
+
+    return run
+
+
+@benchmark("collection.load")
+def bench_collection_load(stores: Stores) -> Callable[[], Any]:
+    documents = [
+        json.loads(json.dumps(collection.dump()))
+        for dated_collections in stores.values()
+        for collection in dated_collections.values()
+    ]
+    return lambda: [Collection.load(document) for document in documents]
+
+
+@benchmark("merged.from_collections")
+def bench_from_collections(stores: Stores) -> Callable[[], Any]:
+    return lambda: merge_stores(stores)
+
+
+@benchmark("merged.dump")
+def bench_merged_dump(stores: Stores) -> Callable[[], Any]:
+    merged_collections = merge_stores(stores)
+    return lambda: [
+        json.dumps(merged_collection.dump())
+        for merged_collection in merged_collections
+    ]
+
+
+@benchmark("merged.load")
+def bench_merged_load(stores: Stores) -> Callable[[], Any]:
+    documents = [
+        json.loads(json.dumps(merged_collection.dump()))
+        for merged_collection in merge_stores(stores)
+    ]
+    return lambda: [MergedCollection.load(document) for document in documents]
+
+
+@benchmark("merged.price_map")
+def bench_price_map(stores: Stores) -> Callable[[], Any]:
+    merged_collections = merge_stores(stores)
+
+    def run() -> None:
+        for merged_collection in merged_collections:
+            merged_collection.__dict__.pop("price_map", None)
+            merged_collection.price_map
+
+    return run
+
+
+@benchmark("changes.find_price_changes")
+def bench_find_price_changes(stores: Stores) -> Callable[[], Any]:
+    matrices = [
+        PriceMatrix.from_merged(merged_collection)
+        for merged_collection in merge_stores(stores)
+    ]
+    return lambda: find_price_changes(matrices)
+
+
+def bench_analyzer(name: str) -> Benchmark:
+    def prepare(stores: Stores) -> Callable[[], Any]:
+        merged_collections = merge_stores(stores)
+        output = Path(tempfile.mkdtemp()) / "output.json"
+        kwargs = ANALYZER_ARGS.get(name, {})
+        if name == "cpi":
+            kwargs = {"file": str(output)}
+
+        # The analyzers take different arguments, so their dict isn't typed.
+        analyzer = cast(Callable[..., Any], ANALYZERS[name])
+
+        def run() -> None:
+            with contextlib.redirect_stdout(io.StringIO()):
+                for merged_collection in merged_collections:
+                    analyzer(merged_collection, **kwargs)
+
+        return run
+
+    return prepare
+
+
+for analyzer in ANALYZERS:
+    benchmark(f"analyze.{analyzer}")(bench_analyzer(analyzer))
+
+
+def measure(func: Callable[[], Any], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def run_benchmarks(
+    *,
+    stores: int,
+    days: List[int],
+    products: List[int],
+    repeat: int,
+    names: Optional[List[str]] = None,
+    **generator_options: Any,
+) -> Iterator[Dict[str, Any]]:
+    names = names or list(BENCHMARKS)
+    for num_days, num_products in itertools.product(days, products):
+        data = generate_stores(
+            stores, days=num_days, products=num_products, **generator_options
+        )
+        items = sum(
+            len(collection.items)
+            for dated_collections in data.values()
+            for collection in dated_collections.values()
+        )
+        for name in names:
+            timings = measure(BENCHMARKS[name](data), repeat)
+            yield {
+                "benchmark": name,
+                "stores": stores,
+                "days": num_days,
+                "products": num_products,
+                "items": items,
+                "min": min(timings),
+                "median": statistics.median(timings),
+                "timings": timings,
+            }
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        revision: Optional[str] = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {
+        "revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.time(),
+    }
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(size) for size in value.split(",")]
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--stores", type=int, default=DEFAULT_STORES)
+    parser.add_argument(
+        "--days", type=parse_sizes, default=DEFAULT_DAYS, help="e.g. 30,90"
+    )
+    parser.add_argument(
+        "--products", type=parse_sizes, default=DEFAULT_PRODUCTS
+    )
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--turnover", type=float, default=0.002)
+    parser.add_argument("--duplicates", type=float, default=0.01)
+    parser.add_argument(
+        "--benchmark",
+        dest="names",
+        action="append",
+        choices=BENCHMARKS.keys(),
+        help="only run the given benchmarks",
+    )
+    parser.add_argument("--output", type=Path, default=None)
+
+    options = parser.parse_args()
+    results = []
+    for result in run_benchmarks(
+        stores=options.stores,
+        days=options.days,
+        products=options.products,
+        repeat=options.repeat,
+        names=options.names,
+        turnover=options.turnover,
+        duplicates=options.duplicates,
+    ):
+        print(
+            f"{result['benchmark']:<35} {result['days']:>5}d"
+            f" x {result['products']:>6}p {result['median']:10.4f}s",
+            file=sys.stderr,
+        )
+        results.append(result)
+
+    report = json.dumps(
+        {"environment": environment(), "results": results}, indent=4
+    )
+    if options.output is None:
+        print(report)
+    else:
+        options.output.write_text(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Measure the memory that a full (multi-store) history takes once it is
+loaded: the items of the daily collections, the keys of the merged
+collections and the prices of their price maps."""
+
+import gc
+import json
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.synthetic import generate_stores
+from inflate.format import Collection, MergedCollection
+
+
+def retained(func: Callable[[], Any]) -> Tuple[Any, int]:
+    """Call the function, and return its result along with the number of
+    bytes that are still allocated after it returns."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        result = func()
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, after - before
+
+
+def benchmark_memory(
+    *, stores: int, days: int, products: int
+) -> Dict[str, Any]:
+    # Start from the dumped documents, like a history that is loaded
+    # from the datastore.
+    documents = {
+        store: {
+            date: json.loads(json.dumps(collection.dump()))
+            for date, collection in dated_collections.items()
+        }
+        for store, dated_collections in generate_stores(
+            stores, days=days, products=products
+        ).items()
+    }
+
+    history, items_size = retained(
+        lambda: {
+            store: {
+                date: Collection.load(document)
+                for date, document in dated_documents.items()
+            }
+            for store, dated_documents in documents.items()
+        }
+    )
+    num_items = sum(
+        len(collection.items)
+        for dated_collections in history.values()
+        for collection in dated_collections.values()
+    )
+
+    merged_collections, merged_size = retained(
+        lambda: [
+            MergedCollection.from_collections(store, dated_collections)
+            for store, dated_collections in history.items()
+        ]
+    )
+    num_products = sum(
+        len(merged_collection.items)
+        for merged_collection in merged_collections
+    )
+
+    price_maps: List[Any] = []
+    _, price_map_size = retained(
+        lambda: price_maps.extend(
+            merged_collection.price_map
+            for merged_collection in merged_collections
+        )
+    )
+    num_prices = sum(
+        len(prices)
+        for price_map in price_maps
+        for prices in price_map.values()
+    )
+
+    return {
+        "stores": stores,
+        "days": days,
+        "products": products,
+        "items": {
+            "count": num_items,
+            "bytes": items_size,
+            "per_item": items_size / num_items,
+        },
+        "merged": {
+            "count": num_products,
+            "bytes": merged_size,
+            "per_product": merged_size / num_products,
+        },
+        "price_map": {
+            "count": num_prices,
+            "bytes": price_map_size,
+            "per_price": price_map_size / num_prices,
+        },
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--stores", type=int, default=4)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--products", type=int, default=2_000)
+
+    options = parser.parse_args()
+    print(
+        json.dumps(
+            benchmark_memory(
+                stores=options.stores,
+                days=options.days,
+                products=options.products,
+            ),
+            indent=4,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
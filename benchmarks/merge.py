@@ -0,0 +1,57 @@
+"""Measure the cost of merging each new day into a MergedCollection."""
+
+import json
+import statistics
+import time
+from argparse import ArgumentParser
+from typing import Any, Dict, List
+
+from benchmarks.synthetic import generate_collections
+from inflate.format import MergedCollection
+
+
+def benchmark_merge(
+    *, days: int, products: int, window: int = 30
+) -> Dict[str, Any]:
+    dated_collections = generate_collections(days=days, products=products)
+
+    timings: List[float] = []
+    merged_collection = MergedCollection("store")
+    for date, collection in sorted(dated_collections.items()):
+        started_at = time.perf_counter()
+        merged_collection.append(date, collection)
+        timings.append(time.perf_counter() - started_at)
+
+    return {
+        "days": days,
+        "products": products,
+        "total": sum(timings),
+        "per_day": [
+            statistics.mean(timings[start : start + window])
+            for start in range(0, days, window)
+        ],
+        "window": window,
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--days", type=int, default=400)
+    parser.add_argument("--products", type=int, default=2_000)
+    parser.add_argument("--window", type=int, default=30)
+
+    options = parser.parse_args()
+    print(
+        json.dumps(
+            benchmark_merge(
+                days=options.days,
+                products=options.products,
+                window=options.window,
+            ),
+            indent=4,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
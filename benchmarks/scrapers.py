@@ -0,0 +1,165 @@
+"""Measure the end-to-end throughput of the scrapers (in each fetch mode)
+by replaying recorded fixtures from a local stand-in server.
+
+The fixtures are recorded with `python -m inflate.tools.record`."""
+
+import asyncio
+import json
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Type
+
+from inflate.metrics import metrics
+from inflate.replay import (
+    ARCHIVE_SUFFIX,
+    FixtureArchive,
+    ReplayTransport,
+    StandInServer,
+    replaying,
+)
+from inflate.scrapers import AVAILABLE_SCRAPERS, Scraper, run_scrapers
+from inflate.scrapers.aio import AVAILABLE_ASYNC_SCRAPERS, run_async_scrapers
+from inflate.utils import exhaust
+
+MODES = ["serial", "threaded", "parallel", "async"]
+DEFAULT_WORKERS = 8
+
+
+def store_results(
+    mode: str, scrapers: List[Type[Scraper]]
+) -> Iterator[Dict[str, Any]]:
+    stores = metrics.report()["stores"]
+    for scraper in scrapers:
+        store = stores.get(scraper.CONFIG["name"])
+        if store is None:
+            continue
+
+        pages = store["status_codes"].get("200", 0)
+        yield {
+            "mode": mode,
+            "store": scraper.CONFIG["name"],
+            "seconds": store["duration"],
+            "pages": pages,
+            "items": store["items"],
+            "requests": store["requests"],
+            "errors": store["errors"],
+            "retries": store["retries"],
+            "pages_per_second": pages / store["duration"],
+            "items_per_second": store["items"] / store["duration"],
+        }
+
+
+def run_mode(
+    mode: str,
+    scrapers: List[Type[Scraper]],
+    server: StandInServer,
+    *,
+    workers: int,
+) -> None:
+    for scraper in scrapers:
+        scraper.CONFIG["workers"] = 1 if mode == "serial" else workers
+
+    if mode == "async":
+
+        async def run() -> None:
+            async for _ in run_async_scrapers(
+                [
+                    AVAILABLE_ASYNC_SCRAPERS[scraper.CONFIG["name"]]
+                    for scraper in scrapers
+                ],
+                max_host_concurrency=workers,
+                http_transport=ReplayTransport(server),
+            ):
+                pass
+
+        asyncio.run(run())
+    elif mode == "parallel":
+        exhaust(run_scrapers(scrapers, parallel=True))
+    else:
+        exhaust(run_scrapers(scrapers))
+
+
+def run_benchmark(
+    fixtures: List[Path],
+    scrapers: List[Type[Scraper]],
+    *,
+    modes: List[str],
+    workers: int = DEFAULT_WORKERS,
+    rate: float = 1e6,
+    **server_options: Any,
+) -> Iterator[Dict[str, Any]]:
+    archive = FixtureArchive.load_all(fixtures)
+    for scraper in scrapers:
+        # Measure the scrapers rather than the politeness towards the
+        # original hosts (unless it is asked for).
+        scraper.CONFIG["rate_limit"] = {
+            "rate": rate,
+            "burst": max(1, int(rate)),
+            "max_concurrency": workers,
+        }
+
+    with StandInServer(archive, **server_options) as server:
+        with replaying(server):
+            for mode in modes:
+                metrics.reset()
+                started_at = time.perf_counter()
+                run_mode(mode, scrapers, server, workers=workers)
+                elapsed = time.perf_counter() - started_at
+
+                results = list(store_results(mode, scrapers))
+                yield from results
+                if mode == "parallel":
+                    pages = sum(result["pages"] for result in results)
+                    items = sum(result["items"] for result in results)
+                    yield {
+                        "mode": mode,
+                        "store": None,
+                        "seconds": elapsed,
+                        "pages": pages,
+                        "items": items,
+                        "pages_per_second": pages / elapsed,
+                        "items_per_second": items / elapsed,
+                    }
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("fixtures", type=Path)
+    parser.add_argument("--scraper", action="append", default=None)
+    parser.add_argument(
+        "--mode", dest="modes", action="append", choices=MODES, default=None
+    )
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--rate", type=float, default=1e6)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+
+    options = parser.parse_args()
+
+    fixtures = sorted(options.fixtures.glob("*" + ARCHIVE_SUFFIX))
+    recorded = {path.name[: -len(ARCHIVE_SUFFIX)] for path in fixtures}
+    names = options.scraper or sorted(recorded & set(AVAILABLE_SCRAPERS))
+    if not names:
+        parser.error(f"no fixtures found under {options.fixtures}")
+
+    results = list(
+        run_benchmark(
+            fixtures,
+            [AVAILABLE_SCRAPERS[name] for name in names],
+            modes=options.modes or MODES,
+            workers=options.workers,
+            rate=options.rate,
+            latency=options.latency,
+            jitter=options.jitter,
+            error_rate=options.error_rate,
+            seed=options.seed,
+        )
+    )
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Synthetic daily collections, for benchmarking."""
+
+import datetime
+import random
+from typing import Dict, List, Optional
+
+from inflate.format import Collection, DatedCollections, Item
+
+START_DATE = datetime.date(2022, 1, 1)
+CATEGORIES = [f"category-{index}" for index in range(20)]
+
+
+def generate_collections(
+    name: str = "store",
+    *,
+    days: int = 365,
+    products: int = 1_000,
+    change_rate: float = 0.05,
+    churn: float = 0.02,
+    turnover: float = 0.0,
+    duplicates: float = 0.0,
+    seed: Optional[int] = 0,
+) -> DatedCollections:
+    """Generate `days` collections for a single store. Each day, a
+    `change_rate` fraction of the products change their prices, and
+    a `churn` fraction of them are missing from the collection.
+
+    A `turnover` fraction of the products are delisted for good each
+    day (and replaced by new ones), and a `duplicates` fraction of the
+    items are scraped twice (like the items that shift between pages)."""
+    rng = random.Random(seed)
+
+    prices: Dict[str, float] = {}
+    categories: Dict[str, str] = {}
+
+    def add_product(index: int) -> None:
+        product = f"{name} product #{index}"
+        prices[product] = round(rng.uniform(1, 500), 2)
+        categories[product] = rng.choice(CATEGORIES)
+
+    for index in range(products):
+        add_product(index)
+
+    dated_collections = {}
+    next_index = products
+    for day in range(days):
+        # Only draw from the generator for the enabled features, so that
+        # the same seed keeps producing the same data without them.
+        for product in list(prices) if turnover else []:
+            if rng.random() < turnover:
+                del prices[product]
+                add_product(next_index)
+                next_index += 1
+
+        items: List[Item] = []
+        for product, price in prices.items():
+            if rng.random() < change_rate:
+                price = prices[product] = round(
+                    price * rng.uniform(0.8, 1.3), 2
+                )
+            if rng.random() < churn:
+                continue
+
+            items.append(
+                Item(
+                    product,
+                    price,
+                    categories[product],
+                    metadata={"brand": product.split()[0]},
+                )
+            )
+            if duplicates and rng.random() < duplicates:
+                items.append(items[-1])
+
+        date = START_DATE + datetime.timedelta(days=day)
+        dated_collections[date] = Collection(name, items)
+
+    return dated_collections
+
+
+def generate_stores(stores: int = 4, **kwargs) -> Dict[str, DatedCollections]:
+    """Generate the collections of multiple stores, with the same
+    parameters (see generate_collections) but different seeds."""
+    seed = kwargs.pop("seed", 0)
+    return {
+        f"store-{index}": generate_collections(
+            f"store-{index}",
+            seed=None if seed is None else seed + index,
+            **kwargs,
+        )
+        for index in range(stores)
+    }
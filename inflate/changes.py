@@ -0,0 +1,160 @@
+"""Price changes over date windows, computed on the price matrices of any
+number of stores at once."""
+
+from __future__ import annotations
+
+import datetime
+import heapq
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from inflate.format import PRECISION, Price, RawProduct
+from inflate.matrix import PriceMatrix
+
+
+@dataclass
+class PriceChange:
+    store: str
+    product: RawProduct
+    initial: Price
+    current: Price
+
+    @property
+    def change(self) -> float:
+        return round(self.current - self.initial, PRECISION)
+
+    @property
+    def percent(self) -> float:
+        return round(100 * (self.current / self.initial - 1), PRECISION)
+
+
+def last_observed(mask: np.ndarray, column: int) -> np.ndarray:
+    """Return the index of each row's last observation at or before the
+    given column, -1 if there is none."""
+    if column < 0:
+        return np.full(len(mask), -1)
+
+    flipped = mask[:, column::-1]
+    return np.where(flipped.any(axis=1), column - flipped.argmax(axis=1), -1)
+
+
+def first_observed(mask: np.ndarray, column: int) -> np.ndarray:
+    """Return the index of each row's first observation at or after the
+    given column, -1 if there is none."""
+    if column >= mask.shape[1]:
+        return np.full(len(mask), -1)
+
+    tail = mask[:, column:]
+    return np.where(tail.any(axis=1), column + tail.argmax(axis=1), -1)
+
+
+@dataclass
+class WindowChanges:
+    """The changed prices of a single store within a date window. Each
+    array has an entry per changed product (whose row is in `rows`)."""
+
+    matrix: PriceMatrix
+    rows: np.ndarray
+    initial: np.ndarray
+    current: np.ndarray
+    absolute: np.ndarray
+    percent: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, index: int) -> PriceChange:
+        row = self.rows[index]
+        initial, current = self.initial[index], self.current[index]
+        return PriceChange(
+            self.matrix.name,
+            self.matrix.products[row],
+            Price(
+                self.matrix.prices[row, initial], self.matrix.dates[initial]
+            ),
+            Price(
+                self.matrix.prices[row, current], self.matrix.dates[current]
+            ),
+        )
+
+
+def window_changes(
+    matrix: PriceMatrix,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+) -> WindowChanges:
+    """Compare each product's price when it enters the window (the last
+    price before the start, or the first price within the window if it
+    is listed later) with its last price within the window."""
+    columns = matrix.columns(start, end)
+    start_column, end_column = columns.start, columns.stop - 1
+
+    mask = ~np.isnan(matrix.prices)
+    initial = last_observed(mask, start_column - 1)
+    entering = initial == -1
+    initial[entering] = first_observed(mask, start_column)[entering]
+    current = last_observed(mask, end_column)
+
+    rows = np.flatnonzero((initial != -1) & (current != -1))
+    initial, current = initial[rows], current[rows]
+    initial_prices = matrix.prices[rows, initial]
+    current_prices = matrix.prices[rows, current]
+    absolute = (current_prices - initial_prices).round(PRECISION)
+
+    changed = (absolute != 0) & (initial_prices > 0)
+    rows, initial, current = rows[changed], initial[changed], current[changed]
+    absolute = absolute[changed]
+    percent = 100 * absolute / initial_prices[changed]
+    return WindowChanges(matrix, rows, initial, current, absolute, percent)
+
+
+def top_changes(
+    windows: Iterable[WindowChanges],
+    k: int = 50,
+    *,
+    increasing: bool = True,
+    percent: bool = False,
+) -> List[PriceChange]:
+    """Select the k largest increases (or decreases) across all windows.
+    Each window is narrowed down to its own top k first, and a heap picks
+    the overall top k from those candidates."""
+    candidates: List[Tuple[float, WindowChanges, int]] = []
+    for window in windows:
+        values = window.percent if percent else window.absolute
+        if not increasing:
+            values = -values
+
+        indices = np.flatnonzero(values > 0)
+        if len(indices) > k:
+            indices = indices[np.argpartition(values[indices], -k)[-k:]]
+        candidates.extend(
+            (value, window, index)
+            for value, index in zip(values[indices].tolist(), indices.tolist())
+        )
+
+    return [
+        window[index]
+        for _, window, index in heapq.nlargest(
+            k, candidates, key=itemgetter(0)
+        )
+    ]
+
+
+def find_price_changes(
+    matrices: Iterable[PriceMatrix],
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    *,
+    k: int = 50,
+    percent: bool = False,
+) -> Tuple[List[PriceChange], List[PriceChange]]:
+    """Return the top k price increases and decreases (by the absolute or
+    the percent change) of all the given stores, within the window."""
+    windows = [window_changes(matrix, start, end) for matrix in matrices]
+    return (
+        top_changes(windows, k, percent=percent),
+        top_changes(windows, k, increasing=False, percent=percent),
+    )
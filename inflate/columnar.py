@@ -0,0 +1,119 @@
+"""A columnar format for collections. Each column is a separate member
+of a NumPy archive, so the readers only load the columns they need."""
+
+from __future__ import annotations
+
+import json
+from typing import IO, Any, Dict, Iterable, List, Sequence, Union
+
+import numpy as np
+
+from inflate.format import Collection, Item
+
+SUFFIX = ".npz"
+STRING_COLUMNS = ("name", "category")
+COLUMNS = ("name", "price", "category", "metadata")
+
+File = Union[str, IO[bytes]]
+
+
+# String columns are dictionary encoded (a UTF-8 blob of the unique
+# values, their offsets, and the index of each item's value) and the
+# metadata is kept apart from the columns as a single JSON document.
+def encode_strings(
+    column: str, values: Sequence[str]
+) -> Dict[str, np.ndarray]:
+    uniques, codes = np.unique(
+        np.array(values, dtype=object), return_inverse=True
+    )
+    encoded = [value.encode() for value in uniques]
+    return {
+        f"{column}.codes": codes.astype(np.int32),
+        f"{column}.blob": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        f"{column}.offsets": np.cumsum(
+            [0] + [len(value) for value in encoded]
+        ),
+    }
+
+
+def decode_strings(archive: Any, column: str) -> List[str]:
+    blob = archive[f"{column}.blob"].tobytes()
+    offsets = archive[f"{column}.offsets"].tolist()
+    uniques = [
+        blob[start:end].decode() for start, end in zip(offsets, offsets[1:])
+    ]
+    return [uniques[code] for code in archive[f"{column}.codes"].tolist()]
+
+
+def dump_columnar(
+    collection: Collection, file: File, *, compress: bool = False
+) -> None:
+    arrays = {
+        "store": np.frombuffer(collection.name.encode(), dtype=np.uint8),
+        "store.metadata": np.frombuffer(
+            json.dumps(collection.metadata, ensure_ascii=False).encode(),
+            dtype=np.uint8,
+        ),
+        "price": np.array(
+            [item.price for item in collection.items], dtype=np.float64
+        ),
+        "metadata": np.frombuffer(
+            json.dumps(
+                [item.metadata for item in collection.items],
+                ensure_ascii=False,
+            ).encode(),
+            dtype=np.uint8,
+        ),
+    }
+    for column in STRING_COLUMNS:
+        arrays.update(
+            encode_strings(
+                column, [getattr(item, column) for item in collection.items]
+            )
+        )
+
+    if compress:
+        np.savez_compressed(file, **arrays)
+    else:
+        np.savez(file, **arrays)
+
+
+def read_columns(
+    file: File, columns: Iterable[str] = COLUMNS
+) -> Dict[str, Any]:
+    """Read the given columns (name, price, category, metadata) of
+    a columnar collection. The price column is returned as an array."""
+    columns = set(columns)
+    data: Dict[str, Any] = {}
+    with np.load(file, allow_pickle=False) as archive:
+        data["store"] = archive["store"].tobytes().decode()
+        # Older snapshots don't have the collection's metadata.
+        data["store.metadata"] = (
+            json.loads(archive["store.metadata"].tobytes())
+            if "store.metadata" in archive.files
+            else {}
+        )
+        for column in STRING_COLUMNS:
+            if column in columns:
+                data[column] = decode_strings(archive, column)
+        if "price" in columns:
+            data["price"] = archive["price"]
+        if "metadata" in columns:
+            data["metadata"] = json.loads(archive["metadata"].tobytes())
+    return data
+
+
+def load_columnar(file: File, *, metadata: bool = True) -> Collection:
+    columns = COLUMNS if metadata else ("name", "price", "category")
+    data = read_columns(file, columns)
+    rows = zip(data["name"], data["price"].tolist(), data["category"])
+    if metadata:
+        items = [
+            Item(name, price, category, item_metadata)
+            for (name, price, category), item_metadata in zip(
+                rows, data["metadata"]
+            )
+        ]
+    else:
+        items = [Item(name, price, category) for name, price, category in rows]
+    return Collection(data["store"], items, data["store.metadata"])
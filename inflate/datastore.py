@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import datetime
+import gzip
+import json
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from inflate.columnar import SUFFIX as COLUMNAR_SUFFIX
+from inflate.columnar import load_columnar
+from inflate.format import (
+    DATE_FMT,
+    Collection,
+    CollectionReader,
+    DatedCollections,
+    Item,
+)
+
+JOURNAL_SUFFIX = ".journal"
+
+SnapshotPaths = Dict[str, Dict[datetime.date, Path]]
+SnapshotColumns = Tuple[str, List[Tuple[str, float, str, Dict[str, Any]]]]
+Watermarks = Dict[str, datetime.date]
+
+
+def load_json(path: Path) -> Collection:
+    with open(path) as stream:
+        return CollectionReader(stream).read()
+
+
+def load_json_gz(path: Path) -> Collection:
+    with gzip.open(path, "rt") as stream:
+        return CollectionReader(stream).read()
+
+
+def load_npz(path: Path) -> Collection:
+    # None of the analyses use the metadata, so don't even read it.
+    return load_columnar(str(path), metadata=False)
+
+
+LOADERS: Dict[str, Callable[[Path], Collection]] = {
+    ".json": load_json,
+    ".json.gz": load_json_gz,
+    COLUMNAR_SUFFIX: load_npz,
+}
+
+
+class SnapshotWriter:
+    """Write a collection to the disk incrementally.
+
+    The items are appended to a journal (one JSON document per line),
+    which is flushed after each page; so a crash only loses the page that
+    was being written. Closing the writer turns the journal into a regular
+    snapshot, where the duplicate items are eliminated just like the way
+    Collection does (the last item wins, in the place of the first one).
+
+    After the items of each (category, page) unit, a checkpoint line is
+    written to the journal; which lets an interrupted scrape to resume
+    from the last completed unit."""
+
+    def __init__(
+        self, path: Path, name: str, *, compress: bool = False
+    ) -> None:
+        self.name = name
+        self.compress = compress
+        self.journal_path = path.with_suffix(JOURNAL_SUFFIX)
+        self.snapshot_path = path.with_suffix(
+            ".json.gz" if compress else ".json"
+        )
+
+        # The journal offset of the last item with each name, in the
+        # order of first appearance.
+        self.offsets: Dict[str, int] = {}
+        self.completed: Set[Tuple[int, int]] = set()
+        self.page_counts: Dict[int, int] = {}
+        self.states: Dict[int, Dict[str, Any]] = {}
+        self.metadata: Dict[str, Any] = {}
+        self._journal: Optional[IO[bytes]] = None
+
+    def __enter__(self) -> SnapshotWriter:
+        if self._journal is None:
+            self.open()
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self) -> None:
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self._journal = open(self.journal_path, "wb")
+        self._write_line({"name": self.name})
+
+    def _write_line(self, data: Dict[str, Any]) -> int:
+        assert self._journal is not None
+        offset = self._journal.tell()
+        self._journal.write(
+            json.dumps(data, ensure_ascii=False).encode() + b"\n"
+        )
+        return offset
+
+    def write(self, items: Iterable[Item]) -> None:
+        for item in items:
+            self.offsets[item.name] = self._write_line(item.dump())
+
+        assert self._journal is not None
+        self._journal.flush()
+
+    def checkpoint(
+        self,
+        category: int,
+        page: int,
+        page_count: Optional[int] = None,
+        state: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Mark the (category, page) unit as completed, after all of
+        its items are written."""
+        unit: Dict[str, Any] = {
+            "unit": [category, page],
+            "page_count": page_count,
+        }
+        if state is not None:
+            unit["state"] = state
+        self._write_line(unit)
+
+        self.completed.add((category, page))
+        if page_count is not None:
+            self.page_counts[category] = page_count
+        if state is not None:
+            self.states[category] = state
+
+        assert self._journal is not None
+        self._journal.flush()
+
+    def abort(self) -> None:
+        """Close the journal, without turning it into a snapshot."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def close(self) -> Path:
+        self.abort()
+
+        partial_path = self.snapshot_path.with_name(
+            self.snapshot_path.name + ".partial"
+        )
+        if self.compress:
+            snapshot = gzip.open(partial_path, "wt")
+        else:
+            snapshot = open(partial_path, "wt")
+
+        with snapshot, open(self.journal_path, "rb") as journal:
+            snapshot.write('{"name": ')
+            snapshot.write(json.dumps(self.name, ensure_ascii=False))
+            snapshot.write(', "items": [')
+            for index, offset in enumerate(self.offsets.values()):
+                journal.seek(offset)
+                if index > 0:
+                    snapshot.write(", ")
+                snapshot.write(journal.readline().decode().rstrip("\n"))
+            snapshot.write('], "metadata": ')
+            snapshot.write(json.dumps(self.metadata, ensure_ascii=False))
+            snapshot.write("}")
+
+        os.replace(partial_path, self.snapshot_path)
+        self.journal_path.unlink()
+        return self.snapshot_path
+
+    @classmethod
+    def replay(
+        cls,
+        journal_path: Path,
+        *,
+        compress: bool = False,
+        completed_only: bool = False,
+    ) -> Tuple[SnapshotWriter, int]:
+        """Rebuild the state of the writer of the given journal. Returns
+        the writer, and the offset where the durable part of the journal
+        ends. If completed_only is set, the items after the last
+        checkpoint are ignored."""
+        with open(journal_path, "rb") as journal:
+            header = json.loads(journal.readline())
+            writer = cls(journal_path, header["name"], compress=compress)
+
+            pending: Dict[str, int] = {}
+            offset = end = journal.tell()
+            # The last line might be cut short by the crash.
+            while (line := journal.readline()).endswith(b"\n"):
+                data = json.loads(line)
+                if "unit" in data:
+                    category, page = data["unit"]
+                    writer.completed.add((category, page))
+                    if data["page_count"] is not None:
+                        writer.page_counts[category] = data["page_count"]
+                    if data.get("state") is not None:
+                        writer.states[category] = data["state"]
+                else:
+                    pending[data["name"]] = offset
+
+                offset = journal.tell()
+                if "unit" in data or not completed_only:
+                    writer.offsets.update(pending)
+                    pending.clear()
+                    end = offset
+
+        return writer, end
+
+    @classmethod
+    def recover(cls, journal_path: Path, *, compress: bool = False) -> Path:
+        """Turn the journal of an interrupted writer into a snapshot, with
+        all the items that made it to the disk."""
+        writer, _ = cls.replay(journal_path, compress=compress)
+        return writer.close()
+
+    @classmethod
+    def resume(
+        cls, journal_path: Path, *, compress: bool = False
+    ) -> SnapshotWriter:
+        """Reopen the journal of an interrupted writer, after discarding
+        everything past its last checkpoint."""
+        writer, end = cls.replay(
+            journal_path, compress=compress, completed_only=True
+        )
+        writer._journal = open(journal_path, "r+b")
+        writer._journal.truncate(end)
+        writer._journal.seek(end)
+        return writer
+
+
+def find_latest_snapshot(datastore: Path, name: str) -> Optional[Path]:
+    store = datastore / name
+    if not store.exists():
+        return None
+
+    return max(
+        (
+            snapshot
+            for snapshot in store.iterdir()
+            if split_snapshot_name(snapshot)[1] in LOADERS
+        ),
+        default=None,
+    )
+
+
+def find_journal(datastore: Path, name: str) -> Optional[Path]:
+    """Find the journal of the latest interrupted scrape of a source."""
+    return max((datastore / name).glob("*" + JOURNAL_SUFFIX), default=None)
+
+
+def split_snapshot_name(path: Path) -> Tuple[str, str]:
+    stem, dot, suffix = path.name.partition(".")
+    return stem, dot + suffix
+
+
+def load_snapshot(path: Path) -> Collection:
+    _, suffix = split_snapshot_name(path)
+    return LOADERS[suffix](path)
+
+
+def load_snapshot_columns(path: Path) -> SnapshotColumns:
+    # Pickling thousands of Item instances across processes costs more
+    # than parsing them, so the workers send plain columns back instead.
+    collection = load_snapshot(path)
+    return collection.name, [
+        (item.name, item.price, item.category, item.metadata)
+        for item in collection.items
+    ]
+
+
+def find_snapshots(
+    paths: Iterable[Path], watermarks: Optional[Watermarks] = None
+) -> SnapshotPaths:
+    """Find the snapshots of each store under the given datastores,
+    skipping the ones that are not newer than the store's watermark."""
+    watermarks = watermarks or {}
+    snapshots: SnapshotPaths = defaultdict(dict)
+    for path in paths:
+        for store in path.iterdir():
+            watermark = watermarks.get(store.name)
+            for snapshot in sorted(store.iterdir()):
+                stem, suffix = split_snapshot_name(snapshot)
+                if suffix not in LOADERS:
+                    continue
+
+                date = datetime.datetime.strptime(stem, DATE_FMT).date()
+                if watermark is not None and date <= watermark:
+                    continue
+
+                snapshots[store.name][date] = snapshot
+    return snapshots
+
+
+def deserialize_snapshots(
+    snapshots: SnapshotPaths, *, max_workers: Optional[int] = None
+) -> Iterator[Tuple[str, DatedCollections]]:
+    """Load the given snapshots on a pool of processes, and yield the
+    collections of each store as soon as all of its snapshots are
+    loaded."""
+    if (max_workers or os.cpu_count() or 1) <= 1:
+        for store, dated_paths in snapshots.items():
+            yield store, {
+                date: load_snapshot(path) for date, path in dated_paths.items()
+            }
+        return None
+
+    remaining = Counter(
+        {store: len(dated_paths) for store, dated_paths in snapshots.items()}
+    )
+    stores: Dict[str, DatedCollections] = defaultdict(dict)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(load_snapshot_columns, path): (store, date)
+            for store, dated_paths in snapshots.items()
+            for date, path in dated_paths.items()
+        }
+        for future in as_completed(futures):
+            store, date = futures[future]
+            name, rows = future.result()
+            stores[store][date] = Collection(
+                name, [Item(*row) for row in rows]
+            )
+
+            remaining[store] -= 1
+            if remaining[store] == 0:
+                yield store, stores.pop(store)
@@ -1,10 +1,25 @@
 from __future__ import annotations
 
 import datetime
+import json
+import re
+import sys
 from collections import UserList, defaultdict
-from dataclasses import asdict, dataclass, field
+from dataclasses import asdict, dataclass, field, fields
 from functools import cached_property
-from typing import Any, Dict, List, Optional, Tuple, Union
+from operator import itemgetter
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 JSON = Union[List[Any], Dict[str, Any]]
 DatedCollections = Dict[datetime.date, "Collection"]
@@ -14,8 +29,56 @@ SEPARATOR = "@"
 DAY_FMT = "%y%m%d"
 DATE_FMT = f"{DAY_FMT}_%H%M%S"
 
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r"\s*")
+# The tokens that matter for finding the end of a skipped value; and the
+# rest of a string (after its opening quote).
+SKIPPED_TOKEN = re.compile(r'["\[\]{}]')
+STRING_BODY = r'[^"\\]*(?:\\.[^"\\]*)*'
+STRING_END = re.compile(STRING_BODY + '"', re.DOTALL)
+NUMBER_PART = re.compile(r"[\d.eE+-]")
+# An object without any nested objects or arrays (like the metadata of
+# the items), which can be skipped in one go.
+FLAT_OBJECT_BODY = r'\{[^"{}\[\]]*(?:"' + STRING_BODY + r'"[^"{}\[\]]*)*\}'
+FLAT_OBJECT = re.compile(FLAT_OBJECT_BODY, re.DOTALL)
+# A dumped item (with its fields in the order that Item.dump() writes
+# them) whose metadata is a flat object.
+FLAT_ITEM = re.compile(
+    r'\s*\{\s*"name"\s*:\s*"(?P<name>' + STRING_BODY + r')"\s*,'
+    r'\s*"price"\s*:\s*(?P<price>-?\d+'
+    r"(?P<fraction>(?:\.\d+)?(?:[eE][-+]?\d+)?))\s*,"
+    r'\s*"category"\s*:\s*"(?P<category>' + STRING_BODY + r')"\s*,'
+    r'\s*"metadata"\s*:\s*' + FLAT_OBJECT_BODY + r"\s*\}",
+    re.DOTALL,
+)
+
+T = TypeVar("T")
+
+
+def slotted(cls: Type[T]) -> Type[T]:
+    """Recreate a dataclass with __slots__ instead of a per-instance
+    __dict__ (dataclass(slots=True) is only available on 3.10+)."""
+    names = tuple(member.name for member in fields(cls))
+    namespace = {
+        key: value
+        for key, value in cls.__dict__.items()
+        if key not in (*names, "__dict__", "__weakref__")
+    }
+    namespace["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)  # type: ignore
+
+
+def intern_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    # Only a handful of brands are shared across thousands of items.
+    brand = metadata.get("brand")
+    if type(brand) is str:
+        metadata["brand"] = sys.intern(brand)
+    return metadata
+
 
 class Node:
+    __slots__ = ()
+
     def dump(self) -> Dict[str, Any]:
         return asdict(self)
 
@@ -24,6 +87,7 @@ class Node:
         raise NotImplementedError
 
 
+@slotted
 @dataclass
 class Item(Node):
     """A single product."""
@@ -33,6 +97,10 @@ class Item(Node):
     category: str
     metadata: Dict[str, Any] = field(default_factory=dict)
 
+    def __post_init__(self) -> None:
+        self.category = sys.intern(self.category)
+        intern_metadata(self.metadata)
+
     @classmethod
     def load(cls, data: Dict[str, Any]) -> Item:
         return cls(
@@ -46,6 +114,7 @@ class Collection(Node):
 
     name: str
     items: List[Item] = field(default_factory=list)
+    metadata: Dict[str, Any] = field(default_factory=dict)
 
     def __post_init__(self) -> None:
         self.eliminate_duplicates()
@@ -58,29 +127,264 @@ class Collection(Node):
 
     @classmethod
     def load(cls, data: Dict[str, Any]) -> Collection:
-        return cls(data["name"], [Item.load(item) for item in data["items"]])
+        return cls(
+            data["name"],
+            [Item.load(item) for item in data["items"]],
+            data.get("metadata", {}),
+        )
 
 
-@dataclass(unsafe_hash=True)
-class RawProduct(str, Node):
-    name: str
-    category: str
+def unescape(string: str) -> str:
+    """Decode the body of a JSON string."""
+    if "\\" not in string:
+        return string
+    return json.loads(f'"{string}"')
+
+
+class CollectionReader:
+    """Incrementally read a dumped collection from a text stream, one
+    item at a time; so that only a small window of the document (rather
+    than the whole document) is kept in the memory.
+
+    If metadata is False, the items are yielded without their metadata
+    (which is skipped over, without being decoded)."""
+
+    def __init__(
+        self,
+        stream: IO[str],
+        *,
+        metadata: bool = True,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> None:
+        self.stream = stream
+        self.metadata = metadata
+        self.chunk_size = chunk_size
+        self.name: Optional[str] = None
+        self.collection_metadata: Dict[str, Any] = {}
+
+        self._buffer = ""
+        self._position = 0
+        self._exhausted = False
+        self._decoder = json.JSONDecoder()
+
+    def _read(self) -> bool:
+        if self._exhausted:
+            return False
+
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self._exhausted = True
+            return False
+
+        self._buffer = self._buffer[self._position :] + chunk
+        self._position = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            match = WHITESPACE.match(self._buffer, self._position)
+            assert match is not None
+            self._position = match.end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            elif not self._read():
+                raise ValueError("unexpected end of the collection")
+
+    def _expect(self, *tokens: str) -> str:
+        token = self._peek()
+        if token not in tokens:
+            raise ValueError(
+                f"expected one of {tokens!r} at {self._position},"
+                f" got {token!r}"
+            )
+        self._position += 1
+        return token
+
+    def _decode(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(
+                    self._buffer, self._position
+                )
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+            else:
+                # A number at the end of the buffer might continue
+                # in the next chunk (e.g. "12." is decoded as 12).
+                if (
+                    end < len(self._buffer)
+                    and not NUMBER_PART.match(self._buffer, end)
+                ) or not self._read():
+                    self._position = end
+                    return value
+
+    def _skip(self) -> None:
+        """Move past the next value without decoding it; only the strings
+        and the brackets are scanned, to find where the value ends."""
+        if self._peek() not in "[{":
+            self._decode()
+            return None
+
+        if flat := FLAT_OBJECT.match(self._buffer, self._position):
+            self._position = flat.end()
+            return None
+
+        depth = 0
+        while True:
+            match = SKIPPED_TOKEN.search(self._buffer, self._position)
+            if match is None:
+                self._position = len(self._buffer)
+            elif match.group() == '"':
+                string = STRING_END.match(self._buffer, match.end())
+                if string is not None:
+                    self._position = string.end()
+                    continue
 
-    def __new__(self, name: str, *args, **kwargs):
-        return str.__new__(self, name)
+                # The string continues in the next chunk.
+                self._position = match.start()
+            else:
+                self._position = match.end()
+                depth += 1 if match.group() in "[{" else -1
+                if depth == 0:
+                    return None
+                continue
+
+            if not self._read():
+                raise ValueError("unexpected end of the collection")
+
+    def _decode_item(self) -> Item:
+        """Decode an item, except for its metadata (which is skipped)."""
+        if match := FLAT_ITEM.match(self._buffer, self._position):
+            self._position = match.end()
+            return Item(
+                unescape(match["name"]),
+                (float if match["fraction"] else int)(match["price"]),
+                unescape(match["category"]),
+            )
+
+        # The items that are laid out differently (or cut short by the
+        # end of the buffer) are decoded one key at a time.
+        data: Dict[str, Any] = {}
+        self._expect("{")
+        while True:
+            key = self._decode()
+            self._expect(":")
+            if key == "metadata":
+                self._skip()
+            else:
+                data[key] = self._decode()
+
+            if self._expect(",", "}") == "}":
+                return Item(data["name"], data["price"], data["category"])
+
+    def _iter_items(self) -> Iterator[Item]:
+        self._expect("[")
+        if self._peek() == "]":
+            self._position += 1
+            return None
+
+        while True:
+            if self.metadata:
+                data = self._decode()
+                yield Item(
+                    data["name"],
+                    data["price"],
+                    data["category"],
+                    data["metadata"],
+                )
+            else:
+                yield self._decode_item()
+
+            if self._expect(",", "]") == "]":
+                return None
+
+    def __iter__(self) -> Iterator[Item]:
+        self._expect("{")
+        if self._peek() == "}":
+            return None
+
+        while True:
+            key = self._decode()
+            self._expect(":")
+            if key == "items":
+                yield from self._iter_items()
+            elif key == "name":
+                self.name = self._decode()
+            elif key == "metadata":
+                self.collection_metadata = self._decode()
+            else:
+                self._decode()
+
+            if self._expect(",", "}") == "}":
+                return None
+
+    def read(self) -> Collection:
+        items = list(self)
+        assert self.name is not None
+        return Collection(self.name, items, self.collection_metadata)
+
+
+class RawProduct(tuple, Node):
+    """The (name, category) pair that identifies a product in a merged
+    collection. It is a plain tuple underneath, and its str() is the
+    name of the product."""
+
+    __slots__ = ()
+
+    name = property(itemgetter(0))
+    category = property(itemgetter(1))
+
+    def __new__(cls, name: str, category: str) -> RawProduct:
+        return tuple.__new__(cls, (name, sys.intern(category)))
+
+    def __getnewargs__(self) -> Tuple[str, str]:
+        return self.name, self.category
+
+    def __str__(self) -> str:
+        return self.name
+
+    def __repr__(self) -> str:
+        return f"RawProduct(name={self.name!r}, category={self.category!r})"
+
+    def dump(self) -> Dict[str, Any]:
+        return {"name": self.name, "category": self.category}
 
     @classmethod
     def load(cls, data: Dict[str, Any]) -> RawProduct:
-        return cls(**data)
+        return cls(data["name"], data["category"])
 
 
-@dataclass(unsafe_hash=True)
 class Price(float):
-    price: float
-    date: datetime.date = field(repr=False)
+    """A price (rounded to the PRECISION), along with the date it is
+    seen at."""
+
+    __slots__ = ("date",)
+    date: datetime.date
 
-    def __new__(self, price: float, *args, **kwargs):
-        return float.__new__(self, round(price, PRECISION))
+    def __new__(cls, price: float, date: datetime.date) -> Price:
+        self = float.__new__(cls, round(price, PRECISION))
+        self.date = date
+        return self
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return type(self), (self.price, self.date)
+
+    @property
+    def price(self) -> float:
+        return float(self)
+
+    def __repr__(self) -> str:
+        return f"Price(price={self.price!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Price):
+            return NotImplemented
+        return (self.price, self.date) == (other.price, other.date)
+
+    def __hash__(self) -> int:
+        return hash((self.price, self.date))
 
 
 @dataclass(init=False)
@@ -104,62 +408,95 @@ class MergedCollection(Node):
     )
     collection_dates: List[datetime.date] = field(default_factory=list)
 
+    # The last known price of each product, which is only used for
+    # appending new collections.
+    _last_prices: Optional[Dict[RawProduct, float]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
     @classmethod
     def from_collections(
         cls, name: str, dated_collections: DatedCollections
     ) -> MergedCollection:
 
-        instance = MergedCollection(name)
-
-        def fill_prices(key, target):
-            items = instance.items.setdefault(key, [])
-            while len(items) < target:
-                items.append(None)
-            return sum(filter(None, reversed(items)))
-
-        index = 0
-        for index, (date, collection) in enumerate(
-            sorted(dated_collections.items(), key=lambda kv: kv[0])
+        instance = cls(name)
+        for date, collection in sorted(
+            dated_collections.items(), key=lambda kv: kv[0]
         ):
-            instance.collection_dates.append(date)
-            for item in collection.items:
-                key = RawProduct(item.name, item.category)
-                last_price = fill_prices(key, index)
-                instance.items[key].append(item.price - last_price)
-
-        for key in instance.items.keys():
-            fill_prices(key, len(instance.collection_dates))
-
+            instance.append(date, collection)
         return instance
 
+    def append(self, date: datetime.date, collection: Collection) -> None:
+        """Fold a new collection (which must be newer than all the merged
+        ones) into this merged collection."""
+        if self.collection_dates and date <= self.collection_dates[-1]:
+            raise ValueError(
+                f"can't append {date}, the collection is already merged"
+                f" until {self.collection_dates[-1]}"
+            )
+
+        if self._last_prices is None:
+            self._last_prices = {
+                key: round(sum(filter(None, prices)), PRECISION)
+                for key, prices in self.items.items()
+            }
+
+        index = len(self.collection_dates)
+        self.collection_dates.append(date)
+        self.__dict__.pop("price_map", None)
+
+        for item in collection.items:
+            key = RawProduct(item.name, item.category)
+            prices = self.items.setdefault(key, [])
+            prices.extend([None] * (index - len(prices)))
+
+            # The deltas are taken between the prices at the PRECISION
+            # (which is also where they are summed back up to), so the last
+            # price is the same whether it is carried over from the previous
+            # append or re-summed from the deltas of a loaded collection.
+            last_price = self._last_prices.get(key, 0)
+            price = round(item.price, PRECISION)
+            if price == last_price:
+                prices.append(0.0)
+            else:
+                prices.append(price - last_price)
+                self._last_prices[key] = price
+
+        for prices in self.items.values():
+            if len(prices) == index:
+                prices.append(None)
+
     def dump(self) -> Dict[str, Any]:
-        raw_data = asdict(self)
-        raw_data["items"] = {
-            key.dump(): value for key, value in raw_data["items"].items()
+        # The products can't be used as JSON keys, so the items
+        # are dumped as a list of [product, prices] pairs.
+        return {
+            "name": self.name,
+            "items": [
+                [key.dump(), list(prices)]
+                for key, prices in self.items.items()
+            ],
+            "collection_dates": [
+                collection_date.strftime(DAY_FMT)
+                for collection_date in self.collection_dates
+            ],
         }
-        raw_data["collection_dates"] = [
-            collection_date.strftime(DAY_FMT)
-            for collection_date in raw_data["collection_dates"]
-        ]
-        return raw_data
 
     @classmethod
     def load(cls, data: Dict[str, Any]) -> MergedCollection:
         return cls(
             data["name"],
             items={
-                RawProduct.load(key): prices
-                for key, prices in data["items"].items()
+                RawProduct.load(key): prices for key, prices in data["items"]
             },
             collection_dates=[
-                datetime.datetime.strptime(raw_date, DAY_FMT)
+                datetime.datetime.strptime(raw_date, DAY_FMT).date()
                 for raw_date in data["collection_dates"]
             ],
         )
 
     @cached_property
-    def price_map(self) -> Dict[str, Prices]:
-        price_map: Dict[str, Prices] = defaultdict(Prices)
+    def price_map(self) -> Dict[RawProduct, Prices]:
+        price_map: Dict[RawProduct, Prices] = defaultdict(Prices)
         for product, price_deltas in self.items.items():
             price = None
 
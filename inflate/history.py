@@ -0,0 +1,351 @@
+"""An embedded (SQLite) database of the observed prices, which is built
+incrementally from the snapshots; so that the ad-hoc questions can be
+answered without re-merging the whole history."""
+
+from __future__ import annotations
+
+import datetime
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from inflate.changes import PriceChange
+from inflate.datastore import Watermarks
+from inflate.format import (
+    PRECISION,
+    Collection,
+    DatedCollections,
+    Price,
+    Prices,
+    RawProduct,
+)
+from inflate.matrix import PriceMatrix
+from inflate.utils import CACHE_DIR
+
+PRICE_HISTORY = CACHE_DIR / "prices.db"
+
+# Each product is identified by its store, name and category (just like
+# the RawProduct keys of a merged collection), and every day it is seen
+# in a collection is a row in the prices table.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY,
+    store TEXT NOT NULL,
+    name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    UNIQUE (store, name, category)
+);
+CREATE INDEX IF NOT EXISTS products_name ON products (name);
+CREATE INDEX IF NOT EXISTS products_category ON products (store, category);
+
+CREATE TABLE IF NOT EXISTS collections (
+    store TEXT NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (store, date)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS prices (
+    product_id INTEGER NOT NULL REFERENCES products (id),
+    date TEXT NOT NULL,
+    price REAL NOT NULL,
+    PRIMARY KEY (product_id, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS prices_date ON prices (date);
+"""
+
+Date = Union[datetime.date, str, None]
+
+
+@dataclass
+class CategoryAggregate:
+    category: str
+    date: datetime.date
+    products: int
+    total: float
+    mean: float
+    low: float
+    high: float
+
+
+def as_date(date: Date) -> Optional[str]:
+    if date is None or isinstance(date, str):
+        return date
+    return date.isoformat()
+
+
+def date_range(column: str, start: Date, end: Date) -> Tuple[str, List[Any]]:
+    """Build an SQL condition (and its parameters) that limits the
+    column to the inclusive [start, end] range."""
+    conditions, parameters = ["1"], []
+    if start is not None:
+        conditions.append(f"{column} >= ?")
+        parameters.append(as_date(start))
+    if end is not None:
+        conditions.append(f"{column} <= ?")
+        parameters.append(as_date(end))
+    return " AND ".join(conditions), parameters
+
+
+class PriceHistory:
+    """A queryable history of the prices of all stores.
+
+    The collections are folded in incrementally (like the merged
+    snapshots, each store has a watermark; see watermarks()), and the
+    queries use the product and date indexes instead of reloading the
+    whole history."""
+
+    def __init__(self, path: Union[Path, str] = PRICE_HISTORY) -> None:
+        if isinstance(path, Path):
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> PriceHistory:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @property
+    def stores(self) -> List[str]:
+        return [
+            store
+            for store, in self.connection.execute(
+                "SELECT DISTINCT store FROM collections ORDER BY store"
+            )
+        ]
+
+    def watermarks(self) -> Watermarks:
+        return {
+            store: datetime.date.fromisoformat(date)
+            for store, date in self.connection.execute(
+                "SELECT store, MAX(date) FROM collections GROUP BY store"
+            )
+        }
+
+    def dates(
+        self, store: str, start: Date = None, end: Date = None
+    ) -> List[datetime.date]:
+        condition, parameters = date_range("date", start, end)
+        return [
+            datetime.date.fromisoformat(date)
+            for date, in self.connection.execute(
+                "SELECT date FROM collections"
+                f" WHERE store = ? AND {condition} ORDER BY date",
+                [store, *parameters],
+            )
+        ]
+
+    def _product_ids(self, store: str) -> Dict[Tuple[str, str], int]:
+        return {
+            (name, category): product_id
+            for product_id, name, category in self.connection.execute(
+                "SELECT id, name, category FROM products WHERE store = ?",
+                [store],
+            )
+        }
+
+    def append(
+        self, store: str, date: datetime.date, collection: Collection
+    ) -> None:
+        self.update([(store, {date: collection})])
+
+    def update(
+        self, grouped_collections: Iterable[Tuple[str, DatedCollections]]
+    ) -> int:
+        """Fold in the collections of each store that are newer than its
+        watermark, and return the number of collections that are added."""
+        watermarks = self.watermarks()
+        added = 0
+        for store, dated_collections in grouped_collections:
+            watermark = watermarks.get(store)
+            product_ids = self._product_ids(store)
+            with self.connection:
+                for date, collection in sorted(dated_collections.items()):
+                    if watermark is not None and date <= watermark:
+                        continue
+
+                    rows = []
+                    for item in collection.items:
+                        key = (item.name, item.category)
+                        if (product_id := product_ids.get(key)) is None:
+                            product_id = product_ids[key] = (
+                                self.connection.execute(
+                                    "INSERT INTO products (store, name,"
+                                    " category) VALUES (?, ?, ?)",
+                                    [store, item.name, item.category],
+                                ).lastrowid
+                            )
+                        rows.append((product_id, date.isoformat(), item.price))
+
+                    self.connection.executemany(
+                        "INSERT OR REPLACE INTO prices VALUES (?, ?, ?)", rows
+                    )
+                    self.connection.execute(
+                        "INSERT INTO collections VALUES (?, ?)",
+                        [store, date.isoformat()],
+                    )
+                    watermark = date
+                    added += 1
+        return added
+
+    def history(
+        self, store: str, name: str, category: Optional[str] = None
+    ) -> Prices:
+        """Return every observed price of a product (in all of its
+        categories, unless one is given)."""
+        query = (
+            "SELECT prices.date, prices.price FROM products"
+            " JOIN prices ON prices.product_id = products.id"
+            " WHERE products.store = ? AND products.name = ?"
+        )
+        parameters = [store, name]
+        if category is not None:
+            query += " AND products.category = ?"
+            parameters.append(category)
+
+        history = Prices()
+        for date, price in self.connection.execute(
+            query + " ORDER BY prices.date", parameters
+        ):
+            history.append(Price(price, datetime.date.fromisoformat(date)))
+        return history
+
+    def top_movers(
+        self,
+        start: Date = None,
+        end: Date = None,
+        *,
+        store: Optional[str] = None,
+        limit: int = 50,
+        increasing: bool = True,
+        percent: bool = False,
+    ) -> List[PriceChange]:
+        """Return the products with the largest price increases (or
+        decreases) between their first and last prices in the given
+        date range, across all stores unless one is given."""
+        condition, parameters = date_range("date", start, end)
+        store_condition = "1"
+        if store is not None:
+            store_condition = "products.store = ?"
+            parameters.append(store)
+
+        change = "last.price - first.price"
+        if percent:
+            change = f"({change}) / first.price"
+
+        query = f"""
+        WITH bounds AS (
+            SELECT product_id, MIN(date) AS first_date,
+                   MAX(date) AS last_date
+            FROM prices WHERE {condition} GROUP BY product_id
+        )
+        SELECT products.store, products.name, products.category,
+               first.date, first.price, last.date, last.price
+        FROM bounds
+        JOIN products ON products.id = bounds.product_id
+        JOIN prices AS first ON first.product_id = bounds.product_id
+                            AND first.date = bounds.first_date
+        JOIN prices AS last ON last.product_id = bounds.product_id
+                           AND last.date = bounds.last_date
+        WHERE {store_condition} AND first.price > 0
+              AND {change} {'>' if increasing else '<'} 0
+        ORDER BY {change} {'DESC' if increasing else 'ASC'}
+        LIMIT ?
+        """
+        return [
+            PriceChange(
+                store,
+                RawProduct(name, category),
+                Price(first_price, datetime.date.fromisoformat(first_date)),
+                Price(last_price, datetime.date.fromisoformat(last_date)),
+            )
+            for (
+                store,
+                name,
+                category,
+                first_date,
+                first_price,
+                last_date,
+                last_price,
+            ) in self.connection.execute(query, [*parameters, limit])
+        ]
+
+    def category_aggregates(
+        self, store: str, start: Date = None, end: Date = None
+    ) -> List[CategoryAggregate]:
+        """Return the daily price aggregates of each category of the
+        store, ordered by the category and the date."""
+        condition, parameters = date_range("prices.date", start, end)
+        return [
+            CategoryAggregate(
+                category,
+                datetime.date.fromisoformat(date),
+                products,
+                round(total, PRECISION),
+                round(mean, PRECISION),
+                low,
+                high,
+            )
+            for category, date, products, total, mean, low, high in (
+                self.connection.execute(
+                    "SELECT products.category, prices.date, COUNT(*),"
+                    " SUM(prices.price), AVG(prices.price),"
+                    " MIN(prices.price), MAX(prices.price)"
+                    " FROM products"
+                    " JOIN prices ON prices.product_id = products.id"
+                    f" WHERE products.store = ? AND {condition}"
+                    " GROUP BY products.category, prices.date"
+                    " ORDER BY products.category, prices.date",
+                    [store, *parameters],
+                )
+            )
+        ]
+
+    def to_matrix(
+        self, store: str, start: Date = None, end: Date = None
+    ) -> PriceMatrix:
+        """Build the price matrix of a store (which all the analyzers
+        accept), optionally limited to a date range."""
+        dates = self.dates(store, start, end)
+        columns = {date.isoformat(): index for index, date in enumerate(dates)}
+
+        products: List[RawProduct] = []
+        rows: Dict[int, int] = {}
+        for product_id, name, category in self.connection.execute(
+            "SELECT id, name, category FROM products"
+            " WHERE store = ? ORDER BY id",
+            [store],
+        ):
+            rows[product_id] = len(products)
+            products.append(RawProduct(name, category))
+
+        condition, parameters = date_range("prices.date", start, end)
+        cursor = self.connection.execute(
+            "SELECT prices.product_id, prices.date, prices.price"
+            " FROM products JOIN prices ON prices.product_id = products.id"
+            f" WHERE products.store = ? AND {condition}",
+            [store, *parameters],
+        )
+
+        prices = np.full((len(products), len(dates)), np.nan)
+        for product_id, date, price in cursor:
+            prices[rows[product_id], columns[date]] = price
+
+        # The products that are not seen in the date range are dropped.
+        seen = ~np.isnan(prices).all(axis=1)
+        return PriceMatrix(
+            store,
+            [product for product, keep in zip(products, seen) if keep],
+            dates,
+            prices[seen].round(PRECISION),
+        )
@@ -0,0 +1,338 @@
+"""Link the same product across the stores.
+
+The products are matched by their identifiers (the barcode-like skus and
+serials) when they have them, and otherwise by their normalized names;
+where the candidates are found through an inverted index of the name
+tokens, so that each product is only compared with the handful of
+products that share enough of its tokens (instead of every other
+product)."""
+
+from __future__ import annotations
+
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import numpy as np
+
+from inflate.format import Collection, RawProduct
+from inflate.matrix import PriceMatrix
+
+# The weights and the volumes are turned into a single canonical token
+# (e.g. both "1,5 lt" and "1500ml" become "1500ml").
+UNITS = {
+    "kg": ("g", 1000),
+    "gr": ("g", 1),
+    "g": ("g", 1),
+    "lt": ("ml", 1000),
+    "l": ("ml", 1000),
+    "cl": ("ml", 10),
+    "ml": ("ml", 1),
+}
+QUANTITY = re.compile(
+    r"(\d+(?:[.,]\d+)?)\s*(" + "|".join(sorted(UNITS, key=len)[::-1]) + r")\b"
+)
+QUANTITY_TOKEN = re.compile(r"\d+(?:g|ml)")
+TOKEN = re.compile(r"[a-z0-9]+")
+# The GTIN-8, GTIN-12 (UPC), GTIN-13 (EAN) and GTIN-14 barcodes.
+BARCODE = re.compile(r"\d{8}|\d{12,14}")
+
+MAX_BLOCK_SIZE = 200
+MIN_SCORE = 0.5
+
+
+def fold(text: str) -> str:
+    """Lowercase the text and strip its diacritics (including the
+    dotless i, which has no decomposition)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(
+        char for char in text if not unicodedata.combining(char)
+    ).replace("ı", "i")
+
+
+def canonical_quantity(match: re.Match) -> str:
+    amount, unit = match.groups()
+    base_unit, scale = UNITS[unit]
+    value = float(amount.replace(",", ".")) * scale
+    return f" {round(value)}{base_unit} "
+
+
+def normalize(name: str) -> Tuple[str, ...]:
+    """Split the name into its normalized tokens."""
+    return tuple(TOKEN.findall(QUANTITY.sub(canonical_quantity, fold(name))))
+
+
+def is_valid_gtin(digits: str) -> bool:
+    """Check the last digit of the barcode against its check digit (the
+    digits are weighted 3 and 1 alternately, starting from the right)."""
+    total = sum(
+        int(digit) * (3 if position % 2 == 0 else 1)
+        for position, digit in enumerate(reversed(digits[:-1]))
+    )
+    return (10 - total % 10) % 10 == int(digits[-1])
+
+
+def normalize_identifier(identifier: Any) -> Optional[str]:
+    """Return the identifier if it is a valid barcode (which is shared
+    across the stores, unlike the internal ids), without the leading
+    zeros."""
+    if identifier is None:
+        return None
+
+    identifier = str(identifier).strip()
+    if BARCODE.fullmatch(identifier) is None or not is_valid_gtin(identifier):
+        return None
+    return identifier.lstrip("0")
+
+
+@dataclass
+class Listing:
+    store: str
+    product: RawProduct
+    tokens: FrozenSet[str]
+    brand: Optional[str] = None
+    identifiers: FrozenSet[str] = frozenset()
+    quantities: FrozenSet[str] = frozenset()
+
+    @classmethod
+    def from_metadata(
+        cls, store: str, product: RawProduct, metadata: Dict[str, Any]
+    ) -> Listing:
+        brand = metadata.get("brand")
+        tokens = set(normalize(product.name))
+        if isinstance(brand, str) and brand.strip():
+            brand = " ".join(normalize(brand)) or None
+        else:
+            brand = None
+
+        identifiers = {
+            identifier
+            for key in ("sku", "serial")
+            if (identifier := normalize_identifier(metadata.get(key)))
+        }
+        quantities = {
+            token for token in tokens if QUANTITY_TOKEN.fullmatch(token)
+        }
+        return cls(
+            store,
+            product,
+            frozenset(tokens),
+            brand,
+            frozenset(identifiers),
+            frozenset(quantities),
+        )
+
+
+def conflicts(left: Listing, right: Listing) -> bool:
+    """Whether the listings have conflicting brands or quantities."""
+    if left.brand and right.brand and left.brand != right.brand:
+        return True
+
+    return bool(
+        left.quantities
+        and right.quantities
+        and left.quantities.isdisjoint(right.quantities)
+    )
+
+
+def similarity(left: Listing, right: Listing) -> float:
+    """The Jaccard similarity of the name tokens, or 0 if the listings
+    have conflicting brands or quantities."""
+    if conflicts(left, right):
+        return 0.0
+
+    return len(left.tokens & right.tokens) / len(left.tokens | right.tokens)
+
+
+@dataclass
+class ProductGroup:
+    """The listings of the same product, at most one per store."""
+
+    listings: Dict[str, Listing] = field(default_factory=dict)
+    score: float = 1.0
+
+    @property
+    def stores(self) -> Set[str]:
+        return set(self.listings)
+
+
+class MatchingIndex:
+    """An index of the listings of all stores, which groups the listings
+    of the same product together (see match())."""
+
+    def __init__(
+        self,
+        *,
+        max_block_size: int = MAX_BLOCK_SIZE,
+        min_score: float = MIN_SCORE,
+    ) -> None:
+        self.max_block_size = max_block_size
+        self.min_score = min_score
+
+        self.listings: List[Listing] = []
+        self.tokens: Dict[str, List[int]] = defaultdict(list)
+        self.identifiers: Dict[str, List[int]] = defaultdict(list)
+
+    @classmethod
+    def from_collections(
+        cls, collections: Iterable[Collection], **kwargs: Any
+    ) -> MatchingIndex:
+        """Build an index from a collection of each store (usually the
+        latest one, since only the collections carry the metadata)."""
+        index = cls(**kwargs)
+        for collection in collections:
+            for item in collection.items:
+                index.add(
+                    Listing.from_metadata(
+                        collection.name,
+                        RawProduct(item.name, item.category),
+                        item.metadata,
+                    )
+                )
+        return index
+
+    def add(self, listing: Listing) -> None:
+        position = len(self.listings)
+        self.listings.append(listing)
+        for token in listing.tokens:
+            self.tokens[token].append(position)
+        for identifier in listing.identifiers:
+            self.identifiers[identifier].append(position)
+
+    def _candidates(self, position: int) -> Iterator[Tuple[int, float]]:
+        """Yield the (candidate, score) of the listings of the other stores
+        that come after the given one, and might be the same product."""
+        listing = self.listings[position]
+        for identifier in listing.identifiers:
+            for candidate in self.identifiers[identifier]:
+                if candidate <= position:
+                    continue
+
+                other = self.listings[candidate]
+                if other.store != listing.store and not conflicts(
+                    listing, other
+                ):
+                    yield candidate, 1.0
+
+        # A pair with a Jaccard similarity of at least min_score shares at
+        # least that fraction of either side's tokens; so only the listings
+        # that share enough tokens are scored. The tokens that are too
+        # common to tell anything apart are not counted.
+        counts: Counter[int] = Counter()
+        skipped = 0
+        for token in listing.tokens:
+            postings = self.tokens[token]
+            if len(postings) > self.max_block_size:
+                skipped += 1
+            else:
+                counts.update(postings)
+
+        required = max(
+            1, math.ceil(self.min_score * len(listing.tokens)) - skipped
+        )
+        for candidate, count in counts.items():
+            if count < required or candidate <= position:
+                continue
+
+            other = self.listings[candidate]
+            if other.store != listing.store:
+                yield candidate, similarity(listing, other)
+
+    def scored_pairs(self) -> List[Tuple[float, int, int]]:
+        """Return the (score, left, right) of the candidate pairs that
+        score at least min_score. The listings with a shared identifier
+        score 1, unless their brands or quantities conflict."""
+        return [
+            (score, position, candidate)
+            for position in range(len(self.listings))
+            for candidate, score in self._candidates(position)
+            if score >= self.min_score
+        ]
+
+    def match(self) -> List[ProductGroup]:
+        """Group the listings greedily, starting from the best scoring
+        pairs; two groups are only merged if they have no stores in
+        common. The products that aren't matched with any other store
+        are left out."""
+        parents = list(range(len(self.listings)))
+        stores = [{listing.store} for listing in self.listings]
+        scores = [1.0] * len(self.listings)
+
+        def find(position: int) -> int:
+            while parents[position] != position:
+                parents[position] = parents[parents[position]]
+                position = parents[position]
+            return position
+
+        for score, left, right in sorted(self.scored_pairs(), reverse=True):
+            left, right = find(left), find(right)
+            if left == right or not stores[left].isdisjoint(stores[right]):
+                continue
+
+            parents[right] = left
+            stores[left] |= stores[right]
+            scores[left] = min(scores[left], scores[right], score)
+
+        members: Dict[int, List[int]] = defaultdict(list)
+        for position in range(len(self.listings)):
+            members[find(position)].append(position)
+
+        return [
+            ProductGroup(
+                {
+                    self.listings[position].store: self.listings[position]
+                    for position in positions
+                },
+                scores[root],
+            )
+            for root, positions in members.items()
+            if len(positions) > 1
+        ]
+
+
+def compare_prices(
+    groups: Iterable[ProductGroup], matrices: Iterable[PriceMatrix]
+) -> List[Dict[str, float]]:
+    """Return the last known price of each group's product in each of
+    its stores (the stores without a known price are left out)."""
+    last_prices: Dict[str, Dict[RawProduct, float]] = {}
+    for matrix in matrices:
+        if not matrix.dates:
+            continue
+
+        observed = ~np.isnan(matrix.prices)
+        has_price = observed.any(axis=1)
+        last = matrix.prices.shape[1] - 1 - observed[:, ::-1].argmax(axis=1)
+        prices = matrix.prices[np.arange(len(matrix.products)), last]
+        last_prices[matrix.name] = {
+            product: price
+            for product, price, known in zip(
+                matrix.products, prices.tolist(), has_price.tolist()
+            )
+            if known
+        }
+
+    comparisons = []
+    for group in groups:
+        comparisons.append(
+            {
+                store: price
+                for store, listing in group.listings.items()
+                if (price := last_prices.get(store, {}).get(listing.product))
+                is not None
+            }
+        )
+    return comparisons
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import bisect
+import datetime
+from dataclasses import dataclass
+from functools import cached_property
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from inflate.format import (
+    PRECISION,
+    MergedCollection,
+    Price,
+    Prices,
+    RawProduct,
+)
+
+# The most collections in a row that a missing price is carried over for,
+# after which the product is considered to be delisted.
+MAX_GAP = 7
+
+
+def reconstruct_prices(deltas: np.ndarray) -> np.ndarray:
+    """Turn a matrix of price deltas (with NaN for the missing days)
+    into the absolute prices."""
+    prices = np.cumsum(np.nan_to_num(deltas, nan=0.0), axis=1)
+    prices[np.isnan(deltas)] = np.nan
+    return prices.round(PRECISION)
+
+
+def forward_fill(
+    prices: np.ndarray, limit: Optional[int] = None
+) -> np.ndarray:
+    """Carry the last known price over the missing days (the days
+    before the first known price stay NaN). If a limit is given, the
+    prices are carried over at most that many columns (collections)."""
+    indices = np.where(np.isnan(prices), 0, np.arange(prices.shape[1]))
+    np.maximum.accumulate(indices, axis=1, out=indices)
+    filled = np.take_along_axis(prices, indices, axis=1)
+    if limit is not None:
+        filled[np.arange(prices.shape[1]) - indices > limit] = np.nan
+    return filled
+
+
+def group_sum(
+    values: np.ndarray, codes: np.ndarray, groups: int
+) -> np.ndarray:
+    """Sum the rows of the values that share the same code."""
+    sums = np.zeros((groups, values.shape[1]))
+    if len(codes) == 0:
+        return sums
+
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(
+        np.concatenate([[True], sorted_codes[1:] != sorted_codes[:-1]])
+    )
+    sums[sorted_codes[starts]] = np.add.reduceat(values[order], starts, axis=0)
+    return sums
+
+
+@dataclass
+class PriceMatrix:
+    """A columnar representation of a merged collection, where each row
+    is a product and each column is a date. Missing prices are NaN."""
+
+    name: str
+    products: List[RawProduct]
+    dates: List[datetime.date]
+    prices: np.ndarray
+
+    @classmethod
+    def from_merged(cls, collection: MergedCollection) -> PriceMatrix:
+        products = list(collection.items.keys())
+        deltas = np.array(
+            list(collection.items.values()), dtype=np.float64
+        ).reshape(len(products), len(collection.collection_dates))
+        return cls(
+            collection.name,
+            products,
+            list(collection.collection_dates),
+            reconstruct_prices(deltas),
+        )
+
+    def columns(
+        self,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+    ) -> slice:
+        """Return the slice of the date columns within the inclusive
+        [start, end] range."""
+        return slice(
+            0 if start is None else bisect.bisect_left(self.dates, start),
+            (
+                len(self.dates)
+                if end is None
+                else bisect.bisect_right(self.dates, end)
+            ),
+        )
+
+    @cached_property
+    def categories(self) -> Tuple[List[str], np.ndarray]:
+        """Return the unique categories, and the category index of
+        each product."""
+        categories, codes = np.unique(
+            [product.category for product in self.products],
+            return_inverse=True,
+        )
+        return categories.tolist(), codes
+
+    @cached_property
+    def changes(self) -> np.ndarray:
+        """A mask of the cells where a product is seen with a new price
+        (including the first time it is seen)."""
+        previous = np.empty_like(self.prices)
+        previous[:, 0] = np.nan
+        previous[:, 1:] = forward_fill(self.prices)[:, :-1]
+        with np.errstate(invalid="ignore"):
+            return ~np.isnan(self.prices) & (self.prices != previous)
+
+    def last_changes(self, count: int) -> np.ndarray:
+        """Return the date indices of each product's last `count` price
+        changes (from the oldest to the newest), -1 if there are fewer."""
+        num_dates = len(self.dates)
+        changes = self.changes.copy()
+        indices = np.full((len(self.products), count), -1)
+        rows = np.arange(len(self.products))
+        for column in range(count - 1, -1, -1):
+            has_change = changes.any(axis=1)
+            last = num_dates - 1 - np.argmax(changes[:, ::-1], axis=1)
+            indices[has_change, column] = last[has_change]
+            changes[rows[has_change], last[has_change]] = False
+        return indices
+
+    def price_history(self, index: int) -> Prices:
+        history = Prices()
+        for date_index in np.flatnonzero(self.changes[index]):
+            history.append(
+                Price(
+                    float(self.prices[index, date_index]),
+                    self.dates[date_index],
+                )
+            )
+        return history
@@ -0,0 +1,260 @@
+"""Instrumentation of the scrapes. Every request made through the shared
+session (or the async transport) is recorded along with the store that
+made it, and the scrapers record the pages they collect; which then can
+be exported as a JSON or a Prometheus textfile report."""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from statistics import mean
+from typing import Any, Dict, Iterator, List, Optional
+
+PROMETHEUS_SUFFIX = ".prom"
+PROMETHEUS_PREFIX = "inflate"
+
+current_store: ContextVar[Optional[str]] = ContextVar(
+    "current_store", default=None
+)
+
+
+@dataclass
+class RequestRecord:
+    store: Optional[str]
+    host: str
+    status: Optional[int]
+    latency: float
+    size: int = 0
+    retries: int = 0
+    proxy: Optional[str] = None
+
+
+@dataclass
+class StoreRecord:
+    started_at: float = field(default_factory=time.perf_counter)
+    finished_at: Optional[float] = None
+    succeeded: bool = False
+    pages: int = 0
+    items: int = 0
+
+    @property
+    def duration(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize_requests(records: List[RequestRecord]) -> Dict[str, Any]:
+    latencies = [record.latency for record in records]
+    return {
+        "requests": len(records),
+        "errors": sum(
+            record.status is None or record.status >= 400 for record in records
+        ),
+        "retries": sum(record.retries for record in records),
+        "bytes": sum(record.size for record in records),
+        "status_codes": dict(
+            Counter(str(record.status) for record in records)
+        ),
+        "latency": {
+            "total": sum(latencies),
+            "mean": mean(latencies),
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "max": max(latencies),
+        }
+        if latencies
+        else {},
+    }
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.requests: List[RequestRecord] = []
+        self.stores: Dict[str, StoreRecord] = {}
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.stores.clear()
+
+    def record_request(self, record: RequestRecord) -> None:
+        with self._lock:
+            self.requests.append(record)
+
+    def record_page(self, items: int) -> None:
+        store = current_store.get()
+        if store is None or store not in self.stores:
+            return None
+
+        with self._lock:
+            self.stores[store].pages += 1
+            self.stores[store].items += items
+
+    @contextmanager
+    def track_store(self, store: str) -> Iterator[StoreRecord]:
+        """Attribute everything in the block to the given store
+        (including the requests of the threads that copy the context)."""
+        record = self.stores[store] = StoreRecord()
+        token = current_store.set(store)
+        try:
+            yield record
+            record.succeeded = True
+        finally:
+            record.finished_at = time.perf_counter()
+            current_store.reset(token)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = list(self.requests)
+
+        store_requests = defaultdict(list)
+        proxy_requests = defaultdict(list)
+        for record in requests:
+            if record.store is not None:
+                store_requests[record.store].append(record)
+            if record.proxy is not None:
+                proxy_requests[record.proxy].append(record)
+
+        stores = {}
+        for name, store in self.stores.items():
+            stores[name] = {
+                "succeeded": store.succeeded,
+                "duration": store.duration,
+                "pages": store.pages,
+                "items": store.items,
+                "pages_per_second": store.pages / store.duration
+                if store.duration
+                else 0.0,
+                **summarize_requests(store_requests[name]),
+            }
+
+        return {
+            "stores": stores,
+            "proxies": {
+                proxy: summarize_requests(records)
+                for proxy, records in proxy_requests.items()
+            },
+            "requests": [asdict(record) for record in requests],
+        }
+
+    def to_prometheus(self) -> str:
+        report = self.report()
+        lines = []
+
+        def add(
+            name: str, kind: str, samples: List[Any], help_text: str
+        ) -> None:
+            name = f"{PROMETHEUS_PREFIX}_{name}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                rendered = ",".join(
+                    f'{key}="{escape_label(label)}"'
+                    for key, label in labels.items()
+                )
+                lines.append(f"{name}{{{rendered}}} {value}")
+
+        stores = report["stores"]
+        for key, name, kind, help_text in [
+            ("duration", "duration_seconds", "gauge", "Scrape duration."),
+            ("pages", "pages_total", "counter", "Pages collected."),
+            ("items", "items_total", "counter", "Items collected."),
+            ("pages_per_second", "pages_per_second", "gauge", "Throughput."),
+            ("requests", "requests_total", "counter", "HTTP requests made."),
+            ("errors", "errors_total", "counter", "Failed HTTP requests."),
+            ("retries", "retries_total", "counter", "Retried HTTP requests."),
+            ("bytes", "received_bytes_total", "counter", "Bytes received."),
+        ]:
+            add(
+                f"store_{name}",
+                kind,
+                [
+                    ({"store": store}, data[key])
+                    for store, data in stores.items()
+                ],
+                help_text,
+            )
+
+        add(
+            "store_responses_total",
+            "counter",
+            [
+                ({"store": name, "status": status}, count)
+                for name, store in stores.items()
+                for status, count in store["status_codes"].items()
+            ],
+            "HTTP responses by status code (None for no response).",
+        )
+        add(
+            "store_latency_seconds_total",
+            "counter",
+            [
+                ({"store": name}, store["latency"]["total"])
+                for name, store in stores.items()
+                if store["latency"]
+            ],
+            "Total time spent on the HTTP requests.",
+        )
+
+        proxies = report["proxies"]
+        for key, name, help_text in [
+            ("requests", "requests_total", "HTTP requests made."),
+            ("errors", "errors_total", "Failed HTTP requests."),
+            ("bytes", "received_bytes_total", "Bytes received."),
+        ]:
+            add(
+                f"proxy_{name}",
+                "counter",
+                [
+                    ({"proxy": proxy}, summary[key])
+                    for proxy, summary in proxies.items()
+                ],
+                help_text,
+            )
+        add(
+            "proxy_latency_seconds_total",
+            "counter",
+            [
+                ({"proxy": proxy}, summary["latency"]["total"])
+                for proxy, summary in proxies.items()
+                if summary["latency"]
+            ],
+            "Total time spent on the HTTP requests.",
+        )
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Path) -> None:
+        """Write the report to the given path, in the Prometheus textfile
+        format if it ends with .prom or as JSON otherwise."""
+        if path.suffix == PROMETHEUS_SUFFIX:
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.report(), indent=4)
+
+        # The textfile collectors might read the file at any moment.
+        partial_path = path.with_name(path.name + ".partial")
+        partial_path.write_text(content)
+        partial_path.replace(path)
+
+
+def escape_label(value: Any) -> str:
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+metrics = Metrics()
@@ -0,0 +1,174 @@
+"""Chained price indices of each store (and each of its categories),
+computed on the price matrices.
+
+Every day is linked to the previous one through the products that are
+priced on both days (the matched models), so the products that enter or
+leave the basket don't distort the index. A product that is missing from
+a few collections keeps its last price for up to MAX_GAP collections
+(not calendar days, since some days have no collection), after which it
+is considered to have left the basket.
+
+There are no quantities in the collections, so the Laspeyres method uses
+a basket with one unit of each product (the ratio of the summed prices);
+and the Jevons method is the geometric mean of the price relatives."""
+
+from __future__ import annotations
+
+import bisect
+import datetime
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Literal, Optional
+
+import numpy as np
+
+from inflate.matrix import MAX_GAP, PriceMatrix, forward_fill, group_sum
+
+Method = Literal["jevons", "laspeyres"]
+
+BASE_VALUE = 100.0
+INDEX_PRECISION = 4
+
+
+def chain_links(
+    prices: np.ndarray,
+    codes: np.ndarray,
+    groups: int,
+    method: Method = "jevons",
+) -> np.ndarray:
+    """Return the price relative of each group between each day and the
+    previous one (1 for the first day, and for the days where none of the
+    group's products are priced on both days)."""
+    previous, current = prices[:, :-1], prices[:, 1:]
+    with np.errstate(invalid="ignore"):
+        matched = (previous > 0) & (current > 0)
+
+    if method == "jevons":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            relatives = np.where(matched, np.log(current / previous), 0.0)
+        numerator = group_sum(relatives, codes, groups)
+        denominator = group_sum(matched.astype(np.float64), codes, groups)
+    elif method == "laspeyres":
+        numerator = group_sum(np.where(matched, current, 0.0), codes, groups)
+        denominator = group_sum(
+            np.where(matched, previous, 0.0), codes, groups
+        )
+    else:
+        raise ValueError("method must be 'jevons' or 'laspeyres'")
+
+    links = np.ones((groups, prices.shape[1]))
+    available = denominator > 0
+    ratios = numerator[available] / denominator[available]
+    links[:, 1:][available] = np.exp(ratios) if method == "jevons" else ratios
+    return links
+
+
+@dataclass
+class PriceIndex:
+    store: str
+    dates: List[datetime.date]
+    base: datetime.date
+    method: Method
+    total: np.ndarray
+    categories: Dict[str, np.ndarray]
+
+    def rows(
+        self, after: Optional[datetime.date] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield a row for each day (that is newer than the given date)."""
+        start = 0 if after is None else bisect.bisect_right(self.dates, after)
+        for column in range(start, len(self.dates)):
+            yield {
+                "store": self.store,
+                "date": self.dates[column].isoformat(),
+                "base": self.base.isoformat(),
+                "method": self.method,
+                "index": round(float(self.total[column]), INDEX_PRECISION),
+                "categories": {
+                    category: round(float(index[column]), INDEX_PRECISION)
+                    for category, index in self.categories.items()
+                },
+            }
+
+
+def compute_index(
+    matrix: PriceMatrix,
+    *,
+    base: Optional[datetime.date] = None,
+    method: Method = "jevons",
+    max_gap: int = MAX_GAP,
+) -> PriceIndex:
+    """Compute the daily index of the store and each of its categories,
+    which is BASE_VALUE on the base date (or the first date after it;
+    the first date of the store if not given)."""
+    if not matrix.dates:
+        raise ValueError(f"{matrix.name} has no collections")
+
+    base_column = 0 if base is None else bisect.bisect_left(matrix.dates, base)
+    if base_column == len(matrix.dates):
+        raise ValueError(
+            f"{matrix.name} has no collections after the base date {base}"
+        )
+
+    categories, codes = matrix.categories
+    prices = forward_fill(matrix.prices, limit=max_gap)
+
+    # The last row is the whole store.
+    links = np.concatenate(
+        [
+            chain_links(prices, codes, len(categories), method),
+            chain_links(prices, np.zeros_like(codes), 1, method),
+        ]
+    )
+
+    chained = np.cumprod(links, axis=1)
+    index = BASE_VALUE * chained / chained[:, [base_column]]
+    return PriceIndex(
+        matrix.name,
+        list(matrix.dates),
+        matrix.dates[base_column],
+        method,
+        index[-1],
+        dict(zip(categories, index[:-1])),
+    )
+
+
+def compute_indices(
+    matrices: Iterable[PriceMatrix], **kwargs: Any
+) -> List[PriceIndex]:
+    """Compute the indices of all the given stores (see compute_index)."""
+    return [compute_index(matrix, **kwargs) for matrix in matrices]
+
+
+def read_watermarks(path: Path) -> Dict[str, datetime.date]:
+    """Return the last written date of each store in an index file."""
+    watermarks: Dict[str, datetime.date] = {}
+    if not path.exists():
+        return watermarks
+
+    with open(path) as stream:
+        for line in stream:
+            row = json.loads(line)
+            date = datetime.date.fromisoformat(row["date"])
+            watermarks[row["store"]] = max(
+                date, watermarks.get(row["store"], date)
+            )
+    return watermarks
+
+
+def append_indices(indices: Iterable[PriceIndex], path: Path) -> int:
+    """Append the days that are not yet in the index file (one JSON
+    document per line and per store/day), so that the readers only need
+    to follow the new lines. Returns the number of the appended lines.
+
+    The chained indices never change for the past days, as long as the
+    base date and the method stay the same."""
+    watermarks = read_watermarks(path)
+    written = 0
+    with open(path, "a") as stream:
+        for index in indices:
+            for row in index.rows(after=watermarks.get(index.store)):
+                stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+                written += 1
+    return written
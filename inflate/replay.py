@@ -0,0 +1,306 @@
+"""Record the responses of the scraped hosts into fixture archives, and
+replay them from a local stand-in server; so that the scrapers can run
+(and be measured) without any network."""
+
+from __future__ import annotations
+
+import base64
+import gzip
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from inflate import request
+
+ARCHIVE_SUFFIX = ".jsonl.gz"
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Retry-After")
+
+# The stand-in server doesn't need any proxies, but the scrapers that
+# go through the proxy pool need at least one to try.
+STAND_IN_PROXY = "http://stand-in.invalid"
+
+
+def fixture_key(url: str) -> str:
+    """Identify a request by its host, path and (sorted) query."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{parts.netloc}{parts.path}?{query}"
+
+
+class FixtureArchive:
+    """The recorded responses of a host (or a few), keyed by the
+    requested URL. Archives are stored as gzipped JSON lines."""
+
+    def __init__(self) -> None:
+        self.responses: Dict[str, Tuple[int, Dict[str, str], bytes]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.responses)
+
+    def add(
+        self, url: str, status: int, headers: Dict[str, str], body: bytes
+    ) -> None:
+        with self._lock:
+            self.responses[fixture_key(url)] = (status, headers, body)
+
+    def get(self, url: str) -> Optional[Tuple[int, Dict[str, str], bytes]]:
+        return self.responses.get(fixture_key(url))
+
+    def update(self, other: FixtureArchive) -> None:
+        with self._lock:
+            self.responses.update(other.responses)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, "wt") as stream:
+            for key, (status, headers, body) in self.responses.items():
+                record = {
+                    "key": key,
+                    "status": status,
+                    "headers": headers,
+                    "body": base64.b64encode(body).decode(),
+                }
+                stream.write(json.dumps(record) + "\n")
+
+    @classmethod
+    def load(cls, path: Path) -> FixtureArchive:
+        archive = cls()
+        with gzip.open(path, "rt") as stream:
+            for line in stream:
+                record = json.loads(line)
+                archive.responses[record["key"]] = (
+                    record["status"],
+                    record["headers"],
+                    base64.b64decode(record["body"]),
+                )
+        return archive
+
+    @classmethod
+    def load_all(cls, paths: List[Path]) -> FixtureArchive:
+        archive = cls()
+        for path in paths:
+            archive.update(cls.load(path))
+        return archive
+
+
+class RecordingAdapter(HTTPAdapter):
+    """A transport adapter which records every successful response
+    into the given archive."""
+
+    def __init__(self, archive: FixtureArchive, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, *args, **kwargs) -> requests.Response:
+        response = super().send(request, *args, **kwargs)
+        if response.status_code == 200:
+            self.archive.add(
+                request.url,
+                response.status_code,
+                {
+                    header: response.headers[header]
+                    for header in KEPT_HEADERS
+                    if header in response.headers
+                },
+                response.content,
+            )
+        return response
+
+
+@contextmanager
+def recording(archive: FixtureArchive) -> Iterator[FixtureArchive]:
+    """Record all the responses of the shared session in the block."""
+    # The development cache would answer the repeated requests without
+    # reaching the adapters.
+    if not request.PRODUCTION:
+        request.requests_cache.uninstall_cache()
+
+    request.configure_session_pool()
+    session = request.session_pool.session
+    session.mount(
+        "https://",
+        RecordingAdapter(
+            archive,
+            pool_connections=request.session_pool.pool_connections,
+            pool_maxsize=request.session_pool.pool_maxsize,
+        ),
+    )
+    try:
+        yield archive
+    finally:
+        request.configure_session_pool()
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog (5) drops the connections of the concurrent
+    # fetchers, which then wait for a SYN retransmission.
+    request_queue_size = 128
+
+
+class StandInServer:
+    """A local HTTP server that serves the responses of an archive, as
+    if it was the original hosts (the requests for https://host/path
+    are sent to http://server/host/path). Each response is delayed by
+    `latency` seconds (plus up to `jitter` seconds), and an `error_rate`
+    fraction of the requests fail with `error_status`."""
+
+    def __init__(
+        self,
+        archive: FixtureArchive,
+        *,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.archive = archive
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = HTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def rewrite(self, url: str) -> str:
+        parts = urlsplit(url)
+        rewritten = f"{self.base_url}/{parts.netloc}{parts.path}"
+        if parts.query:
+            rewritten += "?" + parts.query
+        return rewritten
+
+    def _plan(self) -> Tuple[float, bool]:
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.error_rate
+            self.errors += fail
+        return delay, fail
+
+    def _make_handler(self) -> Any:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Send the headers and the body together, so that the
+            # replies don't get stuck behind the delayed ACKs.
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                delay, fail = server._plan()
+                time.sleep(delay)
+
+                fixture = server.archive.get("http://" + self.path[1:])
+                headers: Dict[str, str]
+                if fail:
+                    status, headers, body = server.error_status, {}, b""
+                elif fixture is None:
+                    status, headers, body = 404, {}, b""
+                else:
+                    status, headers, body = fixture
+
+                self.send_response(status)
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        return Handler
+
+    def start(self) -> StandInServer:
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> StandInServer:
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+
+class ReplayAdapter(HTTPAdapter):
+    """A transport adapter which sends all the requests to the stand-in
+    server, bypassing the proxies."""
+
+    def __init__(self, server: StandInServer, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.server = server
+
+    def send(self, request, *args, **kwargs) -> requests.Response:
+        request = request.copy()
+        request.url = self.server.rewrite(request.url)
+        kwargs["proxies"] = {}
+        return super().send(request, *args, **kwargs)
+
+
+class ReplayTransport(httpx.AsyncHTTPTransport):
+    """The async counterpart of ReplayAdapter."""
+
+    def __init__(self, server: StandInServer, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.server = server
+
+    async def handle_async_request(
+        self, request: httpx.Request
+    ) -> httpx.Response:
+        request.url = httpx.URL(self.server.rewrite(str(request.url)))
+        return await super().handle_async_request(request)
+
+
+@contextmanager
+def replaying(server: StandInServer) -> Iterator[StandInServer]:
+    """Route all the requests of the shared session (and the proxied
+    ones) to the given stand-in server within the block."""
+    if not request.PRODUCTION:
+        request.requests_cache.uninstall_cache()
+
+    request.configure_session_pool()
+    session = request.session_pool.session
+    adapter = ReplayAdapter(
+        server,
+        pool_connections=request.session_pool.pool_connections,
+        pool_maxsize=request.session_pool.pool_maxsize,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    request.proxy_pool.pin([STAND_IN_PROXY])
+    try:
+        yield server
+    finally:
+        request.proxy_pool.unpin()
+        request.configure_session_pool()
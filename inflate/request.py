@@ -1,8 +1,23 @@
-from typing import Iterator, Optional, Set, Tuple
+import asyncio
+import atexit
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from inflate.utils import PRODUCTION
+from inflate.metrics import RequestRecord, current_store, metrics
+from inflate.utils import CACHE_DIR, PRODUCTION, logger
 
 if not PRODUCTION:
     import requests_cache
@@ -13,23 +28,331 @@ if not PRODUCTION:
 PROXY_BASE = "https://cagriari.com/fresh_proxy.txt"
 TARGET_COUNTRY = "TR"
 MAX_PROXY_TIMEOUT = 30
-BLACKLISTED_PROXIES: Set[str] = set()
+HEALTH_CHECK_URL = os.getenv(
+    "PROXY_HEALTH_CHECK_URL", "https://httpbin.org/ip"
+)
+HEALTH_CHECK_WORKERS = 16
+PROXY_TTL = 15 * 60
+PROXY_ROTATION = 8
+PROXY_SCOREBOARD = CACHE_DIR / "proxies.json"
+MIN_PROXY_ATTEMPTS = 3
+MIN_PROXY_SUCCESS_RATE = 0.25
+LATENCY_SMOOTHING = 0.3
 
 DEFAULT_COUNTER = 1 if PRODUCTION else 0
 
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 16
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+MAX_BACKOFF = 30
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 10
+MIN_RATE = 0.5
+THROTTLED_STATUS = 429
+DEFAULT_MAX_CONCURRENCY = 16
+MIN_CONCURRENCY = 1
+DECREASE_FACTOR = 0.5
+LATENCY_TOLERANCE = 3.0
+
+
+def backoff_delay(
+    attempt: int,
+    headers: Mapping[str, str],
+    backoff_factor: float = BACKOFF_FACTOR,
+) -> float:
+    """Return how long to wait before the next attempt, preferring
+    the server's Retry-After hint when it is given in seconds."""
+    try:
+        delay = float(headers["Retry-After"])
+    except (KeyError, ValueError):
+        delay = backoff_factor * 2**attempt
+    return min(delay, MAX_BACKOFF)
+
+
+class HostLimiter:
+    """Pace the requests to a single host. A token bucket caps the rate
+    of the requests, and the number of concurrent requests is adjusted
+    AIMD-style: it grows by one every `limit` successful responses, and
+    is halved when the host starts to push back (a throttling / server
+    error status, or a latency well above the best observed one). The
+    refill rate of the bucket is adjusted the same way, but it is only
+    halved when the host explicitly throttles (429) the requests."""
+
+    def __init__(
+        self,
+        *,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        min_concurrency: int = MIN_CONCURRENCY,
+    ) -> None:
+        self.rate = self.max_rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+
+        self.limit = float(max(min_concurrency, max_concurrency // 2))
+        self.in_flight = 0
+        self.tokens = float(burst)
+        self.latency: Optional[float] = None
+        self.best_latency: Optional[float] = None
+
+        self._refilled_at = time.monotonic()
+        self._decreased_at = 0.0
+        self._condition = threading.Condition()
+
+    def _take_token(self) -> float:
+        """Take a token if there is one, otherwise return how long it
+        would take for the next one to be available."""
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self._refilled_at) * self.rate
+        )
+        self._refilled_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> None:
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            while delay := self._take_token():
+                self._condition.wait(delay)
+
+    def _take_slot(self) -> bool:
+        with self._condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    async def acquire_async(self) -> None:
+        """Same as acquire(), but without blocking the event loop. A free
+        slot is polled for at the pace of the tokens, since no request
+        can start any faster than that."""
+        while not self._take_slot():
+            await asyncio.sleep(1 / self.rate)
+
+        while True:
+            with self._condition:
+                delay = self._take_token()
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+
+    def release(self, status: Optional[int], latency: float) -> None:
+        """Release a slot, adapting the concurrency to the outcome of the
+        request. A request that failed without a response (most likely
+        due to the proxy) doesn't tell anything about the host."""
+        with self._condition:
+            self.in_flight -= 1
+            if status is not None:
+                self._adapt(status, latency)
+            self._condition.notify_all()
+
+    def _adapt(self, status: int, latency: float) -> None:
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+        if self.best_latency is None or self.latency < self.best_latency:
+            self.best_latency = self.latency
+
+        if (
+            status in RETRY_STATUSES
+            or self.latency > self.best_latency * LATENCY_TOLERANCE
+        ):
+            # The responses of the requests that were already in flight
+            # would carry the same signal, so back off once per round
+            # trip.
+            now = time.monotonic()
+            if now - self._decreased_at >= self.latency:
+                self._decreased_at = now
+                self.limit = max(
+                    self.min_concurrency, self.limit * DECREASE_FACTOR
+                )
+                if status == THROTTLED_STATUS:
+                    self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+
+class RateLimiter:
+    """The limiters of the hosts that the scrapers talk to. The requests
+    to the other hosts are not paced."""
+
+    def __init__(self) -> None:
+        self.hosts: Dict[str, HostLimiter] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, url: str, **limits: Any) -> HostLimiter:
+        host = urlsplit(url).netloc
+        with self._lock:
+            limiter = self.hosts[host] = HostLimiter(**limits)
+        return limiter
+
+    def get(self, url: str) -> Optional[HostLimiter]:
+        return self.hosts.get(urlsplit(url).netloc)
+
+
+rate_limiter = RateLimiter()
+
+
+class SessionPool:
+    """A shared session which keeps a pool of alive connections for
+    each host, and retries the throttled / failed requests with an
+    exponential backoff."""
+
+    def __init__(
+        self,
+        *,
+        pool_connections: int = POOL_CONNECTIONS,
+        pool_maxsize: int = POOL_MAXSIZE,
+        max_retries: int = MAX_RETRIES,
+        backoff_factor: float = BACKOFF_FACTOR,
+    ) -> None:
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        self._session: Optional[requests.Session] = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                self._session = self.create_session()
+            return self._session
+
+    def create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(
+        self, url: str, *, max_retries: Optional[int] = None, **kwargs: Any
+    ) -> requests.Response:
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        record = RequestRecord(
+            store=current_store.get(),
+            host=urlsplit(url).netloc,
+            status=None,
+            latency=0.0,
+            proxy=(kwargs.get("proxies") or {}).get("https"),
+        )
+        started_at = time.perf_counter()
+        try:
+            for attempt in range(max_retries + 1):
+                record.retries = attempt
+                response = self.paced_get(url, **kwargs)
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt == max_retries
+                ):
+                    break
+
+                time.sleep(
+                    backoff_delay(
+                        attempt, response.headers, self.backoff_factor
+                    )
+                )
+        finally:
+            record.latency = time.perf_counter() - started_at
+            metrics.record_request(record)
+
+        record.status = response.status_code
+        record.size = len(response.content)
+        return response
+
+    def paced_get(self, url: str, **kwargs: Any) -> requests.Response:
+        limiter = rate_limiter.get(url)
+        if limiter is None:
+            return self.session.get(url, **kwargs)
+
+        limiter.acquire()
+        status = None
+        started_at = time.monotonic()
+        try:
+            response = self.session.get(url, **kwargs)
+            status = response.status_code
+        finally:
+            limiter.release(status, time.monotonic() - started_at)
+        return response
+
+    def close(self) -> None:
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+session_pool = SessionPool()
+
+
+def configure_session_pool(**options: Any) -> None:
+    global session_pool
+
+    session_pool.close()
+    session_pool = SessionPool(**options)
+
 
 def make_call(*args, **kwargs) -> requests.Response:
-    response = requests.get(*args, **kwargs)
+    response = session_pool.get(*args, **kwargs)
     response.raise_for_status()
     return response
 
 
-def check_proxy_health(proxy_addr: str, timeout: float) -> bool:
+def conditional_headers(fingerprint: Optional[str]) -> Dict[str, str]:
+    """Build the headers for revalidating a resource against its
+    fingerprint, if the fingerprint came from the host's validators."""
+    kind, _, value = (fingerprint or "").partition(":")
+    if kind == "etag":
+        return {"If-None-Match": value}
+    elif kind == "last-modified":
+        return {"If-Modified-Since": value}
+    else:
+        return {}
+
+
+def fingerprint_response(response: requests.Response, data: Any) -> str:
+    """Identify the content of a response; through the validators of
+    the host when it provides them, otherwise by hashing the given
+    (parsed) data."""
+    if etag := response.headers.get("ETag"):
+        return f"etag:{etag}"
+    elif last_modified := response.headers.get("Last-Modified"):
+        return f"last-modified:{last_modified}"
+    else:
+        digest = hashlib.sha256(
+            json.dumps(data, sort_keys=True).encode()
+        ).hexdigest()
+        return f"sha256:{digest}"
+
+
+def check_proxy_health(
+    proxy_addr: str, timeout: float, url: str = HEALTH_CHECK_URL
+) -> bool:
     try:
-        response = requests.get(
-            "https://httpbin.org/ip",
+        response = session_pool.get(
+            url,
             timeout=timeout,
-            proxies={"https": proxy_addr},
+            proxies={"http": proxy_addr, "https": proxy_addr},
+            max_retries=0,
         )
     except requests.RequestException:
         return False
@@ -37,7 +360,7 @@ def check_proxy_health(proxy_addr: str, timeout: float) -> bool:
         return response.status_code == 200
 
 
-def parse_proxies(data: str) -> Iterator[str]:
+def parse_proxies(data: str) -> List[Tuple[str, float]]:
     viable_proxies = []
 
     for line in data.splitlines():
@@ -60,30 +383,234 @@ def parse_proxies(data: str) -> Iterator[str]:
 
         viable_proxies.append(("http://" + proxy_ip, timing))
 
-    for proxy_addr, timeout in sorted(viable_proxies):
-        if proxy_addr in BLACKLISTED_PROXIES:
-            continue
+    return viable_proxies
+
+
+@dataclass
+class ProxyScore:
+    successes: int = 0
+    failures: int = 0
+    latency: Optional[float] = None
+
+    @property
+    def success_rate(self) -> float:
+        # Laplace smoothing, so that a single result doesn't
+        # dominate the score of a fresh proxy.
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    @property
+    def cost(self) -> float:
+        if self.latency is None:
+            return MAX_PROXY_TIMEOUT / self.success_rate
+        return self.latency / self.success_rate
+
+    @property
+    def is_banned(self) -> bool:
+        attempts = self.successes + self.failures
+        return (
+            attempts >= MIN_PROXY_ATTEMPTS
+            and self.success_rate < MIN_PROXY_SUCCESS_RATE
+        )
+
+    def record(self, success: bool, latency: Optional[float] = None) -> None:
+        if success:
+            self.successes += 1
+        else:
+            self.failures += 1
+
+        if latency is None:
+            return None
+        elif self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+
+
+class ProxyPool:
+    """A long-lived pool of proxies. The healthy proxies are discovered
+    with concurrent health checks and cached for `ttl` seconds; each
+    proxy is scored by its latency and success rate, and the scores
+    are persisted to `scoreboard_path` so that they survive restarts
+    (they are loaded on the first use, not when the pool is created)."""
+
+    def __init__(
+        self,
+        *,
+        source: str = PROXY_BASE,
+        health_check_url: str = HEALTH_CHECK_URL,
+        ttl: float = PROXY_TTL,
+        scoreboard_path: Optional[Path] = PROXY_SCOREBOARD,
+        max_workers: int = HEALTH_CHECK_WORKERS,
+    ) -> None:
+        self.source = source
+        self.health_check_url = health_check_url
+        self.ttl = ttl
+        self.scoreboard_path = scoreboard_path
+        self.max_workers = max_workers
+
+        self._scores: Optional[Dict[str, ProxyScore]] = None
+        self._healthy: List[str] = []
+        self._expires_at = 0.0
+        self._rotation = itertools.count()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def scores(self) -> Dict[str, ProxyScore]:
+        if self._scores is None:
+            with self._load_lock:
+                if self._scores is None:
+                    self._scores = self.load_scoreboard()
+        return self._scores
+
+    def load_scoreboard(self) -> Dict[str, ProxyScore]:
+        scores: Dict[str, ProxyScore] = defaultdict(ProxyScore)
+        if self.scoreboard_path is None or not self.scoreboard_path.exists():
+            return scores
+
+        try:
+            with open(self.scoreboard_path) as stream:
+                for proxy, score in json.load(stream).items():
+                    scores[proxy] = ProxyScore(**score)
+        except (json.JSONDecodeError, AttributeError, TypeError):
+            # A corrupted scoreboard (e.g. cut short by a crash) is not
+            # worth failing for; the scores are collected again.
+            logger.warning(
+                f"Ignoring the unreadable proxy scoreboard at"
+                f" {self.scoreboard_path}"
+            )
+            return defaultdict(ProxyScore)
+        return scores
+
+    def save_scoreboard(self) -> None:
+        # There is nothing new to save, if the scores are never used.
+        if self.scoreboard_path is None or self._scores is None:
+            return None
+
+        with self._lock:
+            scoreboard = {
+                proxy: asdict(score) for proxy, score in self._scores.items()
+            }
+
+        self.scoreboard_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.scoreboard_path, "w") as stream:
+            json.dump(scoreboard, stream)
+
+    def fetch_candidates(self) -> List[Tuple[str, float]]:
+        response = session_pool.get(self.source)
+        if response.status_code != 200:
+            return []
+
+        return [
+            (proxy, timing)
+            for proxy, timing in parse_proxies(response.text)
+            if not self.scores[proxy].is_banned
+        ]
+
+    def check_health(self, proxy: str, timing: float) -> bool:
+        started_at = time.perf_counter()
+        is_healthy = check_proxy_health(
+            proxy,
+            min(timing + 5, MAX_PROXY_TIMEOUT),
+            url=self.health_check_url,
+        )
+        if is_healthy:
+            self.report(proxy, True, time.perf_counter() - started_at)
+        else:
+            self.report(proxy, False)
+        return is_healthy
+
+    def refresh(self) -> None:
+        candidates = self.fetch_candidates()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(
+                lambda candidate: self.check_health(*candidate), candidates
+            )
+            healthy = [
+                proxy
+                for (proxy, _), is_healthy in zip(candidates, results)
+                if is_healthy
+            ]
+
+        with self._lock:
+            self._healthy = healthy
+            self._expires_at = time.monotonic() + self.ttl
+        self.save_scoreboard()
+
+    def pin(self, proxies: List[str]) -> None:
+        """Use the given proxies, without discovering (or expiring) them,
+        until the pool is unpinned."""
+        with self._lock:
+            self._healthy = list(proxies)
+            self._expires_at = float("inf")
+
+    def unpin(self) -> None:
+        with self._lock:
+            # Don't let the pinned proxies leak into the scoreboard.
+            for proxy in self._healthy:
+                self.scores.pop(proxy, None)
+            self._healthy = []
+            self._expires_at = 0.0
+
+    def healthy(self) -> List[str]:
+        """Return the healthy proxies, from the best to the worst."""
+        with self._refresh_lock:
+            if time.monotonic() >= self._expires_at:
+                self.refresh()
+
+        with self._lock:
+            return sorted(
+                (
+                    proxy
+                    for proxy in self._healthy
+                    if not self.scores[proxy].is_banned
+                ),
+                key=lambda proxy: self.scores[proxy].cost,
+            )
+
+    def rotate(self) -> Iterator[str]:
+        """Yield the healthy proxies for a single request. Consecutive
+        calls start from different proxies among the best ones, so that
+        the parallel requests are spread across them."""
+        proxies = self.healthy()
+        if not proxies:
+            return None
+
+        best, rest = proxies[:PROXY_ROTATION], proxies[PROXY_ROTATION:]
+        offset = next(self._rotation) % len(best)
+        yield from best[offset:] + best[:offset] + rest
+
+    def report(
+        self, proxy: str, success: bool, latency: Optional[float] = None
+    ) -> None:
+        with self._lock:
+            self.scores[proxy].record(success, latency)
+
 
-        if check_proxy_health(proxy_addr, timeout + 5):
-            yield proxy_addr
+proxy_pool = ProxyPool()
+atexit.register(proxy_pool.save_scoreboard)
 
 
 def get_proxies() -> Iterator[str]:
-    response = requests.get(PROXY_BASE)
-    if response.status_code == 200:
-        yield from parse_proxies(response.text)
+    return proxy_pool.rotate()
 
 
 def proxy_call(*args, **kwargs) -> Optional[requests.Response]:
     kwargs.setdefault("timeout", MAX_PROXY_TIMEOUT)
     for proxy in get_proxies():
-        kwargs.setdefault("proxies", {"https": proxy})
+        started_at = time.perf_counter()
         try:
-            response = requests.get(*args, **kwargs)
-        except requests.Timeout:
-            BLACKLISTED_PROXIES.add(proxy)
+            response = session_pool.get(
+                *args, proxies={"https": proxy}, **kwargs
+            )
+        except (requests.Timeout, requests.ConnectionError):
+            proxy_pool.report(proxy, success=False)
             continue
         else:
+            proxy_pool.report(
+                proxy, success=True, latency=time.perf_counter() - started_at
+            )
             response.raise_for_status()
             return response
     else:
@@ -1,10 +1,10 @@
 import json
 import re
-from typing import Any, Iterator
+from typing import Any, Dict, Iterator, List
 
-from inflate.format import JSON, Collection, Item
+from inflate.format import Item
 from inflate.request import make_call, requests
-from inflate.scrapers.scraper import Scraper
+from inflate.scrapers.scraper import Page, Scraper
 from inflate.utils import progress, robust
 
 RE_JSON = re.compile(
@@ -21,17 +21,20 @@ class A101(Scraper):
     CONFIG: Any = {"name": "a101", "max_page_limit": 50}
 
     @robust(default=EMPTY_ITEM)
-    def request(self, **kwargs) -> JSON:
+    def request(self, **kwargs) -> Dict[str, Any]:
         response = make_call(self.BASE_URL, **kwargs)
+        return self.parse_document(response.text)
 
-        if not (match := RE_JSON.search(response.text)):
+    def parse_document(self, document: str) -> Dict[str, Any]:
+        if not (match := RE_JSON.search(document)):
             return EMPTY_ITEM
 
         return json.loads(match.group(1))
 
-    def collect_page(self, page: int) -> Iterator[Item]:
-        data = self.request(params={"page": page})
+    def collect_page(self, page: int) -> List[Item]:
+        return list(self.parse_page(self.request(params={"page": page})))
 
+    def parse_page(self, data: Dict[str, Any]) -> Iterator[Item]:
         for raw_item in data["@graph"]["itemListElement"]:
             item = raw_item["item"]
             if item["offers"]["availability"] != "https://schema.org/InStock":
@@ -46,14 +49,12 @@ class A101(Scraper):
                 },
             )
 
-    def scrape(self) -> Collection:
-        page = 0
-        collection = Collection(self.CONFIG["name"])
-        for _ in progress(range(self.CONFIG["max_page_limit"])):
-            items = list(self.collect_page(page))
-            if not items:
-                break
-            collection.items.extend(items)
-            page += 1
-
-        return collection
+    def iter_pages(self) -> Iterator[Page]:
+        pages = self.checkpoint.pending(
+            0, range(self.CONFIG["max_page_limit"])
+        )
+        for page, items in progress(
+            zip(pages, self.fetch_until_empty(self.collect_page, pages)),
+            total=len(pages),
+        ):
+            yield Page(0, page, items)
@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Type,
+    TypeVar,
+)
+from urllib.parse import urlsplit
+
+import httpx
+
+from inflate.format import Collection, Item
+from inflate.metrics import RequestRecord, current_store, metrics
+from inflate.request import (
+    MAX_PROXY_TIMEOUT,
+    MAX_RETRIES,
+    RETRY_STATUSES,
+    backoff_delay,
+    get_proxies,
+    proxy_pool,
+    rate_limiter,
+)
+from inflate.scrapers.a101 import A101
+from inflate.scrapers.a101 import EMPTY_ITEM as A101_EMPTY_ITEM
+from inflate.scrapers.macro_center import MacroCenter
+from inflate.scrapers.migros import EMPTY_ITEM as MIGROS_EMPTY_ITEM
+from inflate.scrapers.migros import Migros
+from inflate.scrapers.scraper import Scraper
+from inflate.scrapers.sok import EMPTY_ITEM as SOK_EMPTY_ITEM
+from inflate.scrapers.sok import Sok
+from inflate.utils import logger, robust
+
+S = TypeVar("S", bound=Scraper)
+
+AVAILABLE_ASYNC_SCRAPERS: Dict[str, Type[AsyncScraper]] = {}
+MAX_HOST_CONCURRENCY = 16
+
+
+class AsyncTransport:
+    """A shared set of HTTP clients (one per proxy), which bounds
+    the number of concurrent requests to each host."""
+
+    def __init__(
+        self,
+        max_host_concurrency: int = MAX_HOST_CONCURRENCY,
+        *,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.max_host_concurrency = max_host_concurrency
+        # A custom transport replaces the network (and the proxies).
+        self.transport = transport
+        self.clients: Dict[Optional[str], httpx.AsyncClient] = {}
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def __aenter__(self) -> AsyncTransport:
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    def get_client(self, proxy: Optional[str] = None) -> httpx.AsyncClient:
+        if proxy not in self.clients:
+            if self.transport is not None:
+                self.clients[proxy] = httpx.AsyncClient(
+                    transport=self.transport, timeout=MAX_PROXY_TIMEOUT
+                )
+            else:
+                self.clients[proxy] = httpx.AsyncClient(
+                    proxy=proxy, timeout=MAX_PROXY_TIMEOUT
+                )
+        return self.clients[proxy]
+
+    def get_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(
+                self.max_host_concurrency
+            )
+        return self.semaphores[host]
+
+    async def get(
+        self, url: str, *, proxy: Optional[str] = None, **kwargs: Any
+    ) -> httpx.Response:
+        record = RequestRecord(
+            store=current_store.get(),
+            host=urlsplit(url).netloc,
+            status=None,
+            latency=0.0,
+            proxy=proxy,
+        )
+        started_at = time.perf_counter()
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                record.retries = attempt
+                async with self.get_semaphore(url):
+                    response = await self.paced_get(url, proxy, **kwargs)
+
+                if (
+                    response.status_code not in RETRY_STATUSES
+                    or attempt == MAX_RETRIES
+                ):
+                    break
+
+                await asyncio.sleep(backoff_delay(attempt, response.headers))
+        finally:
+            record.latency = time.perf_counter() - started_at
+            metrics.record_request(record)
+
+        record.status = response.status_code
+        record.size = len(response.content)
+        response.raise_for_status()
+        return response
+
+    async def paced_get(
+        self, url: str, proxy: Optional[str], **kwargs: Any
+    ) -> httpx.Response:
+        """Send the request through the host's limiter (the same one that
+        paces the regular scrapers), if the host has one."""
+        limiter = rate_limiter.get(url)
+        if limiter is None:
+            return await self.get_client(proxy).get(url, **kwargs)
+
+        await limiter.acquire_async()
+        status = None
+        started_at = time.monotonic()
+        try:
+            response = await self.get_client(proxy).get(url, **kwargs)
+            status = response.status_code
+        finally:
+            limiter.release(status, time.monotonic() - started_at)
+        return response
+
+    async def proxy_get(
+        self, url: str, **kwargs: Any
+    ) -> Optional[httpx.Response]:
+        proxies = get_proxies()
+        proxy: Optional[str]
+        while proxy := await asyncio.to_thread(next, proxies, None):
+            started_at = time.perf_counter()
+            try:
+                response = await self.get(url, proxy=proxy, **kwargs)
+            except httpx.TransportError:
+                proxy_pool.report(proxy, success=False)
+            else:
+                proxy_pool.report(
+                    proxy,
+                    success=True,
+                    latency=time.perf_counter() - started_at,
+                )
+                return response
+        else:
+            return None
+
+    async def close(self) -> None:
+        await asyncio.gather(
+            *(client.aclose() for client in self.clients.values())
+        )
+        self.clients.clear()
+
+
+class AsyncScraper(Generic[S]):
+    """Scrape a source, asynchronously. Each async scraper is a port of a
+    regular scraper, and uses an instance of it for its configuration
+    and parsers."""
+
+    SCRAPER: Type[S]
+    CONFIG: Any
+
+    def __init_subclass__(cls) -> None:
+        cls.CONFIG = cls.SCRAPER.CONFIG
+        AVAILABLE_ASYNC_SCRAPERS[cls.CONFIG["name"]] = cls
+
+    def __init__(self, transport: AsyncTransport) -> None:
+        # Also sets up the rate limiter of the source (see Scraper).
+        self.scraper = self.SCRAPER()
+        self.transport = transport
+
+    async def scrape(self) -> Collection:
+        ...
+
+
+class AsyncMigros(AsyncScraper[Migros]):
+    SCRAPER = Migros
+
+    @robust(default=MIGROS_EMPTY_ITEM)
+    async def request(self, **kwargs) -> Dict[str, Any]:
+        response = await self.transport.get(self.scraper.BASE_URL, **kwargs)
+
+        data = response.json()
+        assert data["successful"]
+        return data["data"]
+
+    async def request_page(self, category: int, page: int) -> Dict[str, Any]:
+        return await self.request(
+            params={"category-id": category, "page": page}
+        )
+
+    async def collect_category(self, category: int) -> List[Item]:
+        meta = await self.request_page(category, 0)
+        category_name = meta["metaData"].get("title")
+        if category_name is None:
+            return []
+
+        pages = await asyncio.gather(
+            *(
+                self.request_page(category, page)
+                for page in range(1, meta["pageCount"] + 1)
+            )
+        )
+        return [
+            item
+            for data in [meta, *pages]
+            for item in self.scraper.parse_page(data, category_name)
+        ]
+
+    async def scrape(self) -> Collection:
+        categories = await asyncio.gather(
+            *map(self.collect_category, self.CONFIG["categories"])
+        )
+        return Collection(
+            name=self.CONFIG["name"],
+            items=[item for items in categories for item in items],
+        )
+
+
+class AsyncMacroCenter(AsyncMigros):
+    SCRAPER = MacroCenter
+
+
+class AsyncA101(AsyncScraper[A101]):
+    SCRAPER = A101
+
+    @robust(default=A101_EMPTY_ITEM)
+    async def request(self, **kwargs) -> Dict[str, Any]:
+        response = await self.transport.get(self.scraper.BASE_URL, **kwargs)
+        return self.scraper.parse_document(response.text)
+
+    async def collect_page(self, page: int) -> List[Item]:
+        data = await self.request(params={"page": page})
+        return list(self.scraper.parse_page(data))
+
+    async def scrape(self) -> Collection:
+        collection = Collection(self.CONFIG["name"])
+
+        # Speculatively request a window of pages at once, and stop
+        # at the first empty one.
+        limit = self.CONFIG["max_page_limit"]
+        window = self.transport.max_host_concurrency
+        for start in range(0, limit, window):
+            pages = await asyncio.gather(
+                *map(
+                    self.collect_page, range(start, min(start + window, limit))
+                )
+            )
+            for items in pages:
+                if not items:
+                    return collection
+                collection.items.extend(items)
+
+        return collection
+
+
+class AsyncSok(AsyncScraper[Sok]):
+    SCRAPER = Sok
+
+    @robust(default=SOK_EMPTY_ITEM)
+    async def request(self, category: int, **kwargs) -> Dict[str, Any]:
+        kwargs.setdefault("headers", {}).setdefault(
+            "store-id", self.CONFIG["store-id"]
+        )
+        try:
+            response = await self.transport.proxy_get(
+                self.scraper.BASE_URL.format(category=category), **kwargs
+            )
+        except httpx.HTTPStatusError as exc:
+            # Sometimes SOK API throws weird errors
+            if exc.response.status_code == 400:
+                return SOK_EMPTY_ITEM
+            else:
+                raise
+
+        if response is None:
+            return SOK_EMPTY_ITEM
+
+        return response.json()
+
+    async def request_page(self, page: int) -> Dict[str, Any]:
+        return await self.request(
+            category=0, params={"stock": "true", "page": page}
+        )
+
+    async def scrape(self) -> Collection:
+        meta = await self.request_page(0)
+        pages = await asyncio.gather(
+            *map(
+                self.request_page,
+                range(1, meta["pagination"]["page_count"] + 1),
+            )
+        )
+        return Collection(
+            name=self.CONFIG["name"],
+            items=[
+                item
+                for data in pages
+                for item in self.scraper.parse_page(data)
+            ],
+        )
+
+
+async def run_async_scraper(
+    scraper: Type[AsyncScraper], transport: AsyncTransport
+) -> Optional[Collection]:
+    logger.debug(f"Running {scraper.CONFIG['name']}")
+    try:
+        with metrics.track_store(scraper.CONFIG["name"]) as store:
+            collection = await scraper(transport).scrape()
+            store.items = len(collection.items)
+            return collection
+    except Exception:
+        logger.exception(
+            f"Exception when processing {scraper.CONFIG['name']!r}"
+        )
+        return None
+
+
+async def run_async_scrapers(
+    scrapers: Iterable[Type[AsyncScraper]],
+    *,
+    max_host_concurrency: int = MAX_HOST_CONCURRENCY,
+    http_transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> AsyncIterator[Collection]:
+    """Run all the given scrapers on the current event loop, and yield
+    their collections in the order of completion."""
+    async with AsyncTransport(
+        max_host_concurrency, transport=http_transport
+    ) as transport:
+        for future in asyncio.as_completed(
+            [run_async_scraper(scraper, transport) for scraper in scrapers]
+        ):
+            if collection := await future:
+                yield collection
@@ -1,8 +1,14 @@
-from typing import Any, Iterator
+from itertools import chain
+from typing import Any, Dict, Iterator, Optional, Tuple
 
-from inflate.format import JSON, Collection, Item
-from inflate.request import make_call, requests
-from inflate.scrapers.scraper import Scraper
+from inflate.format import Item
+from inflate.request import (
+    conditional_headers,
+    fingerprint_response,
+    make_call,
+    requests,
+)
+from inflate.scrapers.scraper import Page, Scraper
 from inflate.utils import progress, robust
 
 EMPTY_ITEM = {"metaData": {}, "pageCount": 0, "storeProductInfos": []}
@@ -14,44 +20,129 @@ class Migros(Scraper):
     CONFIG: Any = {"name": "migros", "categories": list(range(1, 11))}
 
     @robust(default=EMPTY_ITEM)
-    def request(self, **kwargs) -> JSON:
+    def request(self, **kwargs) -> Dict[str, Any]:
         response = make_call(self.BASE_URL, **kwargs)
 
         data = response.json()
         assert data["successful"]
         return data["data"]
 
-    def collect_category(self, category: int) -> Iterator[Item]:
-        meta = self.request(params={"category-id": category, "page": 0})
+    def request_page(self, category: int, page: int) -> Dict[str, Any]:
+        return self.request(params={"category-id": category, "page": page})
+
+    @robust(default=(EMPTY_ITEM, None))
+    def request_first_page(
+        self, category: int, fingerprint: Optional[str] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Request the first page of the category along with its
+        fingerprint. If the page is not modified since the given
+        fingerprint, there is no data to return."""
+        response = make_call(
+            self.BASE_URL,
+            params={"category-id": category, "page": 0},
+            headers=conditional_headers(fingerprint),
+        )
+        if response.status_code == 304:
+            return None, fingerprint
+
+        data = response.json()
+        assert data["successful"]
+        return data["data"], fingerprint_response(response, data["data"])
+
+    def carry_over(self, category: int, state: Dict[str, Any]) -> Page:
+        assert self.previous is not None
+        state = self.metadata["categories"][str(category)] = {
+            **state,
+            "carried_over": True,
+        }
+        items = [
+            item
+            for item in self.previous.items
+            if item.category == state["title"]
+        ]
+        return Page(category, 0, items, page_count=0, state=state)
+
+    def collect_category(self, category: int) -> Iterator[Page]:
+        checkpointed_count = self.checkpoint.page_counts.get(category)
+        if checkpointed_count is not None and not self.checkpoint.pending(
+            category, range(checkpointed_count + 1)
+        ):
+            # The category is already scraped in full, but its state
+            # still needs to make it to the final snapshot.
+            if (state := self.checkpoint.states.get(category)) is not None:
+                categories = self.metadata.setdefault("categories", {})
+                categories[str(category)] = state
+            return None
+
+        previous_state = None
+        if self.previous is not None:
+            previous_state = self.previous.metadata.get("categories", {}).get(
+                str(category)
+            )
+
+        self.metadata.setdefault("categories", {})
+        meta, fingerprint = self.request_first_page(
+            category, previous_state and previous_state["fingerprint"]
+        )
+        if previous_state is not None and (
+            meta is None or fingerprint == previous_state["fingerprint"]
+        ):
+            yield self.carry_over(category, previous_state)
+            return None
+
+        assert meta is not None
         category_name = meta["metaData"].get("title")
         if category_name is None:
             return None
 
-        for page in progress(
-            range(meta["pageCount"] + 1),
+        state = self.metadata["categories"][str(category)] = {
+            "title": category_name,
+            "fingerprint": fingerprint,
+            "carried_over": False,
+        }
+        page_count: int = meta["pageCount"]
+        first_page = (
+            [(0, meta)] if self.checkpoint.pending(category, [0]) else []
+        )
+        pages = self.checkpoint.pending(category, range(1, page_count + 1))
+        for page, data in progress(
+            chain(
+                first_page,
+                zip(
+                    pages,
+                    self.fetch_pages(
+                        lambda page: self.request_page(category, page), pages
+                    ),
+                ),
+            ),
+            total=len(first_page) + len(pages),
             description=f"Scraping {category_name!r}",
         ):
-            data = self.request(params={"category-id": category, "page": page})
-
-            for product in data["storeProductInfos"]:
-                yield Item(
-                    product["name"],
-                    product["salePrice"] / 100,
-                    category_name,
-                    metadata={
-                        "id": product["id"],
-                        "sku": product["sku"],
-                        "brand": product["brand"]["name"],
-                        "sub_category": product["category"]["name"],
-                    },
-                )
-
-    def scrape(self) -> Collection:
-        return Collection(
-            name=self.CONFIG["name"],
-            items=[
-                item
-                for category in self.CONFIG["categories"]
-                for item in self.collect_category(category)
-            ],
-        )
+            yield Page(
+                category,
+                page,
+                list(self.parse_page(data, category_name)),
+                page_count,
+                state,
+                complete=data is not EMPTY_ITEM,
+            )
+
+    def parse_page(
+        self, data: Dict[str, Any], category_name: str
+    ) -> Iterator[Item]:
+        for product in data["storeProductInfos"]:
+            yield Item(
+                product["name"],
+                product["salePrice"] / 100,
+                category_name,
+                metadata={
+                    "id": product["id"],
+                    "sku": product["sku"],
+                    "brand": product["brand"]["name"],
+                    "sub_category": product["category"]["name"],
+                },
+            )
+
+    def iter_pages(self) -> Iterator[Page]:
+        for category in self.CONFIG["categories"]:
+            yield from self.collect_category(category)
@@ -1,11 +1,85 @@
 from __future__ import annotations
 
-from typing import Any, Iterable, Iterator, Type
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from functools import wraps
+from itertools import islice
+from operator import methodcaller
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+)
 
-from inflate.format import Collection
+from inflate.format import Collection, Item
+from inflate.metrics import metrics
+from inflate.request import rate_limiter
 from inflate.utils import logger
 
+T = TypeVar("T")
+
 AVAILABLE_SCRAPERS = {}
+DEFAULT_WORKERS = 8
+
+
+def in_context(func: Callable[..., T]) -> Callable[..., T]:
+    """Run the given function in (a copy of) the current context, even
+    when it is called from another thread."""
+    context = contextvars.copy_context()
+
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+@dataclass
+class Page:
+    """A single page of items, from a category of a source."""
+
+    category: int
+    page: int
+    items: List[Item]
+
+    # The number of pages in the category, as reported by the source.
+    page_count: Optional[int] = None
+
+    # The scraper's metadata about the category (if it keeps any), which
+    # is checkpointed along with the page so a resumed scrape can restore
+    # it without revisiting the category.
+    state: Optional[Dict[str, Any]] = None
+
+    # Whether the page is actually fetched; the pages that fall back to an
+    # empty default are not checkpointed, so a resumed scrape retries them.
+    complete: bool = True
+
+
+@dataclass
+class Checkpoint:
+    """The (category, page) units that are already scraped in a previous
+    run, along with the page counts and the states of their categories."""
+
+    completed: Set[Tuple[int, int]] = field(default_factory=set)
+    page_counts: Dict[int, int] = field(default_factory=dict)
+    states: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+
+    def pending(self, category: int, pages: Iterable[int]) -> List[int]:
+        return [
+            page for page in pages if (category, page) not in self.completed
+        ]
 
 
 class Scraper:
@@ -17,16 +91,115 @@ class Scraper:
         cls.CONFIG = cls.CONFIG.copy()
         AVAILABLE_SCRAPERS[cls.__name__.casefold()] = cls
 
-    def scrape(self) -> Collection:
-        ...
+    def __init__(
+        self,
+        checkpoint: Optional[Checkpoint] = None,
+        previous: Optional[Collection] = None,
+    ) -> None:
+        self.checkpoint = checkpoint or Checkpoint()
+
+        # The last snapshot of the source; when given, the scrapers that
+        # can tell which parts of the source are unchanged reuse the
+        # items of those parts instead of scraping them again.
+        self.previous = previous
+        self.metadata: Dict[str, Any] = {}
+
+        # The requests to the source are paced by the limits under the
+        # "rate_limit" key (see HostLimiter), or the default ones.
+        if base_url := getattr(self, "BASE_URL", None):
+            rate_limiter.configure(
+                base_url, **self.CONFIG.get("rate_limit", {})
+            )
 
+    @property
+    def workers(self) -> int:
+        return self.CONFIG.get("workers", DEFAULT_WORKERS)
 
-def run_scrapers(scrapers: Iterable[Type[Scraper]]) -> Iterator[Collection]:
-    for scraper in scrapers:
-        logger.debug(f"Running {scraper.CONFIG['name']}")
-        try:
-            yield scraper().scrape()
-        except Exception:
-            logger.exception(
-                f"Exception when processing {scraper.CONFIG['name']!r}"
+    def fetch_pages(
+        self, fetch: Callable[[int], T], pages: Sequence[int]
+    ) -> Iterator[T]:
+        """Fetch all the given pages concurrently, and yield
+        the results in the same order with the pages."""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            yield from executor.map(in_context(fetch), pages)
+
+    def fetch_until_empty(
+        self, fetch: Callable[[int], T], pages: Iterable[int]
+    ) -> Iterator[T]:
+        """Speculatively fetch the upcoming pages (while keeping at
+        most `workers` requests in flight), until the first empty
+        one is seen."""
+        remaining_pages = iter(pages)
+        fetch = in_context(fetch)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            in_flight: Deque = deque(
+                executor.submit(fetch, page)
+                for page in islice(remaining_pages, self.workers)
             )
+            while in_flight:
+                result = in_flight.popleft().result()
+                if not result:
+                    break
+
+                yield result
+                for page in islice(remaining_pages, 1):
+                    in_flight.append(executor.submit(fetch, page))
+
+            for future in in_flight:
+                future.cancel()
+
+    def iter_pages(self) -> Iterator[Page]:
+        ...
+
+    def pages(self) -> Iterator[Page]:
+        for page in self.iter_pages():
+            metrics.record_page(len(page.items))
+            yield page
+
+    def scrape(self) -> Collection:
+        return Collection(
+            name=self.CONFIG["name"],
+            items=[item for page in self.pages() for item in page.items],
+            metadata=self.metadata,
+        )
+
+
+def run_scraper(
+    scraper: Type[Scraper],
+    runner: Callable[[Scraper], Optional[T]] = methodcaller("scrape"),
+) -> Optional[T]:
+    logger.debug(f"Running {scraper.CONFIG['name']}")
+    try:
+        with metrics.track_store(scraper.CONFIG["name"]):
+            return runner(scraper())
+    except Exception:
+        logger.exception(
+            f"Exception when processing {scraper.CONFIG['name']!r}"
+        )
+        return None
+
+
+def run_scrapers(
+    scrapers: Iterable[Type[Scraper]],
+    *,
+    parallel: bool = False,
+    runner: Callable[[Scraper], Optional[T]] = methodcaller("scrape"),
+) -> Iterator[T]:
+    """Run the given scrapers, and yield their collections (or whatever
+    the runner returns for each scraper). If parallel is set, each scraper
+    runs on its own thread and the results are yielded in the order of
+    completion."""
+    if parallel:
+        scrapers = list(scrapers)
+        with ThreadPoolExecutor(max_workers=len(scrapers) or 1) as executor:
+            futures = [
+                executor.submit(run_scraper, scraper, runner)
+                for scraper in scrapers
+            ]
+            for future in as_completed(futures):
+                if (result := future.result()) is not None:
+                    yield result
+    else:
+        for scraper in scrapers:
+            if (result := run_scraper(scraper, runner)) is not None:
+                yield result
@@ -1,10 +1,10 @@
-from typing import Iterator
+from typing import Any, Dict, Iterator
 
 from requests import HTTPError
 
-from inflate.format import JSON, Collection, Item
+from inflate.format import Item
 from inflate.request import proxy_call
-from inflate.scrapers.scraper import Scraper
+from inflate.scrapers.scraper import Page, Scraper
 from inflate.utils import progress, robust
 
 EMPTY_ITEM = {"pagination": {"page_count": 0}, "payload": {"products": []}}
@@ -16,7 +16,7 @@ class Sok(Scraper):
     CONFIG = {"name": "sok", "store-id": "2359"}
 
     @robust(default=EMPTY_ITEM)
-    def request(self, category: int, **kwargs) -> JSON:
+    def request(self, category: int, **kwargs) -> Dict[str, Any]:
         kwargs.setdefault("headers", {}).setdefault(
             "store-id", self.CONFIG["store-id"]
         )
@@ -37,25 +37,35 @@ class Sok(Scraper):
         data = response.json()
         return data
 
-    def scrape(self) -> Collection:
-        meta = self.request(category=0, params={"stock": "true", "page": 0})
+    def request_page(self, page: int) -> Dict[str, Any]:
+        return self.request(category=0, params={"stock": "true", "page": page})
 
-        items = []
-        for page in progress(range(1, meta["pagination"]["page_count"] + 1)):
-            data = self.request(
-                category=0, params={"stock": "true", "page": page}
+    def parse_page(self, data: Dict[str, Any]) -> Iterator[Item]:
+        for product in data["payload"]["products"]:
+            yield Item(
+                product["product_name"],
+                product["price"]["original"],
+                product["category_breadcrumb"],
+                metadata={
+                    "brand": product["brand"],
+                    "serial": product["serial_id"],
+                },
+            )
+
+    def iter_pages(self) -> Iterator[Page]:
+        page_count = self.checkpoint.page_counts.get(0)
+        if page_count is None:
+            page_count = self.request_page(0)["pagination"]["page_count"]
+
+        pages = self.checkpoint.pending(0, range(1, page_count + 1))
+        for page, data in progress(
+            zip(pages, self.fetch_pages(self.request_page, pages)),
+            total=len(pages),
+        ):
+            yield Page(
+                0,
+                page,
+                list(self.parse_page(data)),
+                page_count,
+                complete=data is not EMPTY_ITEM,
             )
-            for product in data["payload"]["products"]:
-                items.append(
-                    Item(
-                        product["product_name"],
-                        product["price"]["original"],
-                        product["category_breadcrumb"],
-                        metadata={
-                            "brand": product["brand"],
-                            "serial": product["serial_id"],
-                        },
-                    )
-                )
-
-        return Collection(name=self.CONFIG["name"], items=items)
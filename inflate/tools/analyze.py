@@ -3,14 +3,13 @@ import datetime
 import io
 import json
 import os
+import shutil
 import textwrap
 import zipfile
 from argparse import ArgumentParser
-from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import partial
 from pathlib import Path
-from tempfile import TemporaryDirectory
 from typing import (
     IO,
     Any,
@@ -19,6 +18,7 @@ from typing import (
     List,
     Literal,
     Optional,
+    Set,
     Tuple,
     Union,
 )
@@ -27,15 +27,16 @@ import requests
 from rich import print
 from rich.progress import track
 
-from inflate.format import (
-    DATE_FMT,
-    JSON,
-    Collection,
-    DatedCollections,
-    MergedCollection,
-    Prices,
-)
-from inflate.utils import exhaust
+from inflate.changes import PriceChange, find_price_changes
+from inflate.datastore import Watermarks, deserialize_snapshots, find_snapshots
+from inflate.format import DAY_FMT, JSON, DatedCollections, MergedCollection
+from inflate.history import PRICE_HISTORY, PriceHistory
+from inflate.matrix import PriceMatrix
+from inflate.price_index import MAX_GAP, Method, append_indices, compute_index
+from inflate.utils import CACHE_DIR, exhaust, logger
+from inflate.volatility import DEFAULT_WINDOW
+from inflate.volatility import METRICS as VOLATILITY_METRICS
+from inflate.volatility import Metric, compute_volatility, rank_volatility
 
 GITHUB_USER = os.getenv("GITHUB_USER")
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
@@ -53,18 +54,26 @@ if not PRODUCTION:
 
 
 DEFAULT_REPO = os.getenv("DEFAULT_REPO", "isidentical/inflate")
-API_BASE = "https://api.github.com"
+API_BASE = os.getenv("GITHUB_API_BASE", "https://api.github.com")
+
+ARTIFACT_CACHE = CACHE_DIR / "artifacts"
+MAX_CACHE_SIZE = int(os.getenv("MAX_CACHE_SIZE", 2 * 1024**3))
+MERGED_SNAPSHOTS = CACHE_DIR / "merged"
 
 
 GroupedCollections = Dict[str, DatedCollections]
 MergedCollections = Dict[str, MergedCollection]
+Snapshot = Tuple[MergedCollection, datetime.date]
+Collection_T = Union[MergedCollection, PriceMatrix]
 
 
-def iter_artifacts(repository: str = DEFAULT_REPO) -> Iterator[Dict[str, Any]]:
+def iter_artifacts(
+    repository: str = DEFAULT_REPO, *, api_base: str = API_BASE
+) -> Iterator[Dict[str, Any]]:
     page = 1
     while True:
         response = requests.get(
-            API_BASE + "/repos/isidentical/inflate/actions/artifacts",
+            api_base + f"/repos/{repository}/actions/artifacts",
             auth=GITHUB_AUTH,
             params={"page": page, "per_page": 100},
         )
@@ -84,173 +93,395 @@ def get_artifact(url: str) -> IO[bytes]:
     return io.BytesIO(response.content)
 
 
-def collect_artifacts(path: Path, repository: str = DEFAULT_REPO) -> None:
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = []
-        for artifact in iter_artifacts(repository):
-            futures.append(
+class ArtifactCache:
+    """A persistent cache of the extracted artifacts, keyed by their ids.
+
+    GitHub lists the artifacts from the newest to the oldest, so syncing
+    stops at the first artifact that is already known. When the cache
+    grows beyond `max_size` bytes, the oldest artifacts are evicted (but
+    still remembered, so that syncing doesn't download them again); they
+    are only restored when a requested date range needs them."""
+
+    def __init__(
+        self, path: Path = ARTIFACT_CACHE, *, max_size: int = MAX_CACHE_SIZE
+    ) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.manifest_path = path / "manifest.json"
+
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path) as stream:
+                self.manifest = json.load(stream)
+
+    def save(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest_path, "w") as stream:
+            json.dump(self.manifest, stream)
+
+    def find_new_artifacts(
+        self, repository: str = DEFAULT_REPO, *, api_base: str = API_BASE
+    ) -> List[Dict[str, Any]]:
+        artifacts = []
+        for artifact in iter_artifacts(repository, api_base=api_base):
+            if str(artifact["id"]) in self.manifest:
+                break
+            if artifact.get("expired"):
+                continue
+            artifacts.append(artifact)
+        return artifacts
+
+    def store(self, artifact: Dict[str, Any], buffer: IO[bytes]) -> None:
+        path = self.path / str(artifact["id"])
+        with zipfile.ZipFile(buffer) as archive:
+            archive.extractall(path)
+
+        # A restored artifact keeps the rest of its entry.
+        self.manifest.setdefault(str(artifact["id"]), {}).update(
+            {
+                "created_at": artifact["created_at"],
+                "size": sum(
+                    file.stat().st_size
+                    for file in path.rglob("*")
+                    if file.is_file()
+                ),
+                "stores": sorted(store.name for store in path.iterdir()),
+                "evicted": False,
+            }
+        )
+
+    def sync(
+        self, repository: str = DEFAULT_REPO, *, api_base: str = API_BASE
+    ) -> int:
+        artifacts = self.find_new_artifacts(repository, api_base=api_base)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {
+                executor.submit(
+                    get_artifact, artifact["archive_download_url"]
+                ): artifact
+                for artifact in artifacts
+            }
+            for future in track(
+                as_completed(futures), transient=True, total=len(futures)
+            ):
+                self.store(futures[future], future.result())
+
+        self.evict()
+        self.save()
+        return len(artifacts)
+
+    def evict(self) -> None:
+        entries = sorted(
+            (
+                (entry["created_at"], artifact_id)
+                for artifact_id, entry in self.manifest.items()
+                if not entry["evicted"]
+            ),
+            reverse=True,
+        )
+
+        total_size = 0
+        for _, artifact_id in entries:
+            entry = self.manifest[artifact_id]
+            total_size += entry["size"]
+            if total_size > self.max_size:
+                shutil.rmtree(self.path / artifact_id, ignore_errors=True)
+                entry["evicted"] = True
+
+    def restore(
+        self,
+        since: Optional[datetime.date] = None,
+        repository: str = DEFAULT_REPO,
+        *,
+        api_base: str = API_BASE,
+    ) -> List[Dict[str, Any]]:
+        """Download the evicted artifacts that are created on or after
+        the given date again (they stay until the next eviction). Returns
+        the entries of the ones that are expired on GitHub."""
+        evicted = {
+            artifact_id: entry
+            for artifact_id, entry in self.manifest.items()
+            if entry["evicted"]
+            and (since is None or artifact_date(entry) >= since)
+        }
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {
                 executor.submit(
                     get_artifact,
-                    artifact["archive_download_url"],
+                    api_base
+                    + f"/repos/{repository}/actions/artifacts/{artifact_id}"
+                    + "/zip",
+                ): artifact_id
+                for artifact_id, entry in evicted.items()
+                if not entry.get("expired")
+            }
+            for future in track(
+                as_completed(futures), transient=True, total=len(futures)
+            ):
+                artifact_id = futures[future]
+                try:
+                    buffer = future.result()
+                except requests.HTTPError:
+                    evicted[artifact_id]["expired"] = True
+                    continue
+
+                self.store(
+                    {
+                        "id": artifact_id,
+                        "created_at": evicted[artifact_id]["created_at"],
+                    },
+                    buffer,
                 )
-            )
 
-        for buffer in track(
-            as_completed(futures), transient=True, total=len(futures)
-        ):
-            archive = zipfile.ZipFile(buffer.result())
-            archive.extractall(path)
+        if evicted:
+            self.save()
+        return [entry for entry in evicted.values() if entry.get("expired")]
+
+    def paths(self) -> Iterator[Path]:
+        for artifact_id, entry in self.manifest.items():
+            if not entry["evicted"]:
+                yield self.path / artifact_id
+
+    def stores(self) -> Set[str]:
+        """The stores that are in any of the artifacts (including the
+        evicted ones, unless they are cached before the stores of the
+        artifacts were recorded)."""
+        stores = set()
+        for artifact_id, entry in self.manifest.items():
+            if "stores" in entry:
+                stores.update(entry["stores"])
+            elif not entry["evicted"]:
+                path = self.path / artifact_id
+                stores.update(store.name for store in path.iterdir())
+        return stores
+
+
+def artifact_date(entry: Dict[str, Any]) -> datetime.date:
+    return datetime.date.fromisoformat(entry["created_at"][:10])
+
+
+def deserialize_tree(
+    path: Path, watermarks: Optional[Watermarks] = None
+) -> GroupedCollections:
+    return dict(deserialize_snapshots(find_snapshots([path], watermarks)))
+
+
+def stream_collections(
+    cache: Optional[ArtifactCache] = None,
+    watermarks: Optional[Watermarks] = None,
+) -> Iterator[Tuple[str, DatedCollections]]:
+    if cache is None:
+        cache = ArtifactCache()
+    cache.sync()
+
+    # Only the artifacts after the oldest watermark are needed; but all
+    # of them are, if any of the stores doesn't have a watermark yet.
+    watermarks = watermarks or {}
+    if cache.stores().issubset(watermarks):
+        since = min(watermarks.values(), default=None)
+    else:
+        since = None
+    if expired := cache.restore(since):
+        dates = sorted(map(artifact_date, expired))
+        logger.warning(
+            f"{len(expired)} evicted artifacts (from {dates[0]} to"
+            f" {dates[-1]}) are expired on GitHub; the collections of"
+            " those dates are missing"
+        )
 
+    yield from deserialize_snapshots(find_snapshots(cache.paths(), watermarks))
 
-def deserialize_tree(path: Path) -> GroupedCollections:
-    stores: GroupedCollections = defaultdict(dict)
-    for store in path.iterdir():
-        for collection in store.glob("*.json"):
-            date = datetime.datetime.strptime(collection.stem, DATE_FMT).date()
-            with open(collection) as stream:
-                stores[store.stem][date] = Collection.load(json.load(stream))
-    return stores
 
+def fetch_collections(
+    cache: Optional[ArtifactCache] = None,
+    watermarks: Optional[Watermarks] = None,
+) -> GroupedCollections:
+    return dict(stream_collections(cache, watermarks))
 
-def fetch_collections() -> GroupedCollections:
-    with TemporaryDirectory() as directory:
-        path = Path(directory)
-        collect_artifacts(path)
-        return deserialize_tree(path)
 
+def load_snapshots(path: Path = MERGED_SNAPSHOTS) -> Dict[str, Snapshot]:
+    snapshots = {}
+    for snapshot in path.glob("*.json"):
+        with open(snapshot) as stream:
+            data = json.load(stream)
+
+        snapshots[snapshot.stem] = (
+            MergedCollection.load(data["collection"]),
+            datetime.datetime.strptime(data["watermark"], DAY_FMT).date(),
+        )
+    return snapshots
 
-def generate_collections() -> MergedCollections:
-    grouped_collections = fetch_collections()
 
-    stores = {}
-    for store, dated_collections in grouped_collections.items():
-        stores[store] = MergedCollection.from_collections(
-            store, dated_collections
+def save_snapshot(
+    collection: MergedCollection, path: Path = MERGED_SNAPSHOTS
+) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / f"{collection.name}.json", "w") as stream:
+        json.dump(
+            {
+                "watermark": collection.collection_dates[-1].strftime(DAY_FMT),
+                "collection": collection.dump(),
+            },
+            stream,
+            ensure_ascii=False,
         )
 
-    return stores
 
+def generate_collections(
+    snapshots_path: Path = MERGED_SNAPSHOTS,
+) -> MergedCollections:
+    snapshots = load_snapshots(snapshots_path)
+    grouped_collections = stream_collections(
+        watermarks={
+            store: watermark for store, (_, watermark) in snapshots.items()
+        }
+    )
 
-def find_most_volatile(
-    collection: MergedCollection, *, volatility_threshold: int = 3
-) -> None:
-    groups: Dict[int, Dict[str, Prices]] = defaultdict(dict)
-    for name, prices in collection.price_map.items():
-        num_prices = len(prices)
-        if num_prices <= volatility_threshold:
+    stores = {
+        store: collection for store, (collection, _) in snapshots.items()
+    }
+    for store, dated_collections in grouped_collections:
+        if not dated_collections:
             continue
 
-        groups[len(prices)][name] = prices
+        merged_collection = stores.setdefault(store, MergedCollection(store))
+        for date, collection in sorted(dated_collections.items()):
+            merged_collection.append(date, collection)
+        save_snapshot(merged_collection, snapshots_path)
+
+    return stores
+
 
-    for num_prices, group in sorted(groups.items()):
-        print(num_prices)
-        print("=" * 50)
-        for name, prices in group.items():
-            print("  ", name, "=>", prices)
+def generate_history(path: Path = PRICE_HISTORY) -> PriceHistory:
+    history = PriceHistory(path)
+    history.update(stream_collections(watermarks=history.watermarks()))
+    return history
+
+
+def as_matrix(collection: Collection_T) -> PriceMatrix:
+    if isinstance(collection, MergedCollection):
+        return PriceMatrix.from_merged(collection)
+    return collection
+
+
+def find_most_volatile(
+    collection: Collection_T,
+    *,
+    volatility_threshold: int = 3,
+    metric: Metric = "cv",
+    window: int = DEFAULT_WINDOW,
+    max_items: int = 50,
+    by: Literal["product", "category", "store"] = "product",
+    max_gap: int = MAX_GAP,
+) -> None:
+    volatility = compute_volatility(
+        as_matrix(collection), window=window, max_gap=max_gap
+    )
+    rows: List[Tuple[str, Dict[str, Any]]]
+    if by == "product":
+        ranked = rank_volatility(
+            [volatility],
+            metric,
+            max_items,
+            min_changes=volatility_threshold,
+        )
+        # The names are not unique (the same name might be listed in
+        # multiple categories), so the rows are kept as pairs.
+        rows = [
+            (product_volatility.product.name, vars(product_volatility))
+            for product_volatility in ranked
+        ]
+    elif by in ("category", "store"):
+        aggregates = volatility.aggregate(
+            by_category=by == "category", min_changes=volatility_threshold
+        )
+        rows = sorted(
+            aggregates.items(),
+            key=lambda item: item[1][metric],
+            reverse=True,
+        )[:max_items]
+    else:
+        raise ValueError("by must be 'product', 'category' or 'store'")
+
+    for index, (name, statistics) in enumerate(rows, 1):
+        print(
+            f"{index}.".ljust(3),
+            repr(textwrap.shorten(name, width=45)).ljust(50),
+            *(
+                f"{statistic}={statistics[statistic]:.3f}"
+                for statistic in VOLATILITY_METRICS
+            ),
+        )
 
 
 def price_changes(
-    collection: MergedCollection,
+    collection: Collection_T,
     *,
     kind: Union[int, Literal["daily", "weekly", "all"]] = "daily",
     max_items: int = 50,
+    percent: bool = False,
 ) -> None:
-    def dump_price_changes(data):
-        for index, (change, [name, initial_price, current_price]) in enumerate(
-            data[:max_items], 1
-        ):
+    def dump_price_changes(changes: List[PriceChange]) -> None:
+        for index, change in enumerate(changes, 1):
+            name = textwrap.shorten(change.product.name, width=45)
+            if percent:
+                amount = f"{change.percent:6.1f} %  "
+            else:
+                amount = f"{change.change:6.1f} TRY"
             print(
                 f"{index}.".ljust(3),
-                repr(textwrap.shorten(name, width=45)).ljust(50),
-                f"{change:6.1f} TRY",
-                f"({initial_price:6.1f} -> {current_price:6.1f})",
-                f"[{initial_price.date} -> {current_price.date}]",
+                repr(name).ljust(50),
+                amount,
+                f"({change.initial.price:6.1f} ->"
+                f" {change.current.price:6.1f})",
+                f"[{change.initial.date} -> {change.current.date}]",
             )
 
-    increased: Dict[float, Any] = {}
-    decreased: Dict[float, Any] = {}
-
     today = datetime.datetime.today().date() - datetime.timedelta(days=1)
     if kind == "daily":
-        date_threshold = today
+        start = today
     elif kind == "weekly":
-        date_threshold = today - datetime.timedelta(weeks=1)
+        start = today - datetime.timedelta(weeks=1)
     elif kind == "all":
-        date_threshold = None
+        start = None
     elif isinstance(kind, int):
-        date_threshold = today - datetime.timedelta(days=kind)
+        start = today - datetime.timedelta(days=kind)
     else:
         raise ValueError("kind must be 'daily', 'weekly' or 'all'")
 
-    for name, prices in collection.price_map.items():
-        if len(prices) <= 1:
-            continue
-
-        initial_price, current_price = prices[-2], prices[-1]
-        if date_threshold is not None and date_threshold > current_price.date:
-            continue
-
-        change = current_price - initial_price
-        if change > 0:
-            data = increased
-        elif change < 0:
-            data = decreased
-        else:
-            continue
-
-        data[change] = (name, initial_price, current_price)
+    increased, decreased = find_price_changes(
+        [as_matrix(collection)], start, k=max_items, percent=percent
+    )
 
     if increased:
         print("[green][bold] Zamlar [/bold][/green]")
-        dump_price_changes(sorted(increased.items(), reverse=True))
+        dump_price_changes(increased)
 
     if decreased:
         print("[red][bold] Indirimler [/bold][/red]")
-        dump_price_changes(sorted(decreased.items()))
-
-
-def fill_prices(prices: List[Optional[float]]) -> Optional[List[float]]:
-    if prices[0] is None:
-        return None
+        dump_price_changes(decreased)
 
-    if prices.count(None) >= len(prices) / 4:
-        return None
 
-    return [price if price is not None else 0 for price in prices]
-
-
-def cpi(collection: MergedCollection, *, file: Optional[str] = None) -> None:
+def cpi(
+    collection: Collection_T,
+    *,
+    file: Optional[str] = None,
+    base: Optional[str] = None,
+    method: Method = "jevons",
+    max_gap: int = MAX_GAP,
+) -> None:
     if file is None:
         print("[red] Please pass a file through --arg file:<path>[/red]")
         exit(1)
 
-    data: Dict[str, List[float]] = defaultdict(list)
-
-    dates = [str(date) for date in collection.collection_dates]
-    for product, raw_prices in collection.items.items():
-        regular_prices = fill_prices(raw_prices)
-        if not regular_prices:
-            continue
-
-        current_price = 0
-        for index, price in enumerate(regular_prices):
-            assert price is not None
-
-            current_price += price  # type: ignore
-            try:
-                index_price = data[product.category][index]
-            except IndexError:
-                index_price = 0
-                data[product.category].append(index_price)
-
-            data[product.category][index] = index_price + current_price
-
-    with open(file, "w") as stream:
-        json.dump(
-            {"store": collection.name, "index": data, "dates": dates},
-            stream,
-            ensure_ascii=False,
-        )
+    index = compute_index(
+        as_matrix(collection),
+        base=None if base is None else datetime.date.fromisoformat(base),
+        method=method,
+        max_gap=max_gap,
+    )
+    append_indices([index], Path(file))
 
 
 ANALYZERS = {"cpi": cpi, "price_changes": price_changes, "volatility": find_most_volatile}  # type: ignore
@@ -277,18 +508,31 @@ def main():
     parser.add_argument("store", type=str.lower)
     parser.add_argument("analysis", choices=ANALYZERS.keys())
     parser.add_argument("--arg", action="append")
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        default=False,
+        help="run on the price history database, instead of the snapshots",
+    )
 
     options = parser.parse_args()
 
-    collections = generate_collections()
-    if options.store not in collections:
-        parser.error(
-            "store must be one of these: " + ", ".join(collections.keys())
-        )
+    if options.history:
+        history = generate_history()
+        stores = history.stores
+    else:
+        collections = generate_collections()
+        stores = list(collections.keys())
 
-    ANALYZERS[options.analysis](
-        collections[options.store], **transform_args(options.arg)
-    )
+    if options.store not in stores:
+        parser.error("store must be one of these: " + ", ".join(stores))
+
+    if options.history:
+        matrix = history.to_matrix(options.store)
+    else:
+        matrix = PriceMatrix.from_merged(collections[options.store])
+
+    ANALYZERS[options.analysis](matrix, **transform_args(options.arg))
 
 
 if __name__ == "__main__":
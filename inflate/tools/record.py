@@ -0,0 +1,43 @@
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import List, Optional
+
+from inflate.format import Collection
+from inflate.replay import ARCHIVE_SUFFIX, FixtureArchive, recording
+from inflate.scrapers import AVAILABLE_SCRAPERS, run_scrapers
+from inflate.utils import logger
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = ArgumentParser(
+        description="Record the responses of the scrapers, for replaying"
+        " them later (see inflate.replay)."
+    )
+    parser.add_argument("fixtures", type=Path)
+    parser.add_argument("--scraper", type=str, default=None)
+
+    options = parser.parse_args(argv)
+
+    if options.scraper:
+        scrapers = [AVAILABLE_SCRAPERS[options.scraper.casefold()]]
+    else:
+        scrapers = list(AVAILABLE_SCRAPERS.values())
+
+    for scraper in scrapers:
+        archive = FixtureArchive()
+        with recording(archive):
+            collections: List[Collection] = list(run_scrapers([scraper]))
+
+        if not collections:
+            continue
+
+        path = options.fixtures / (scraper.CONFIG["name"] + ARCHIVE_SUFFIX)
+        archive.save(path)
+        logger.info(
+            f"Recorded {len(archive)} responses"
+            f" ({len(collections[0].items)} items) to {path}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,196 @@
+import asyncio
 import gzip
 import json
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Callable, Iterable, List, Optional, Type
 
-from inflate.format import DATE_FMT
-from inflate.scrapers import AVAILABLE_SCRAPERS, run_scrapers
+from inflate.columnar import SUFFIX, dump_columnar, load_columnar
+from inflate.datastore import (
+    SnapshotWriter,
+    find_journal,
+    find_latest_snapshot,
+    load_snapshot,
+)
+from inflate.format import DATE_FMT, Collection
+from inflate.metrics import metrics
+from inflate.request import configure_session_pool
+from inflate.scrapers import AVAILABLE_SCRAPERS, Scraper, run_scrapers
+from inflate.scrapers.aio import (
+    AVAILABLE_ASYNC_SCRAPERS,
+    MAX_HOST_CONCURRENCY,
+    run_async_scrapers,
+)
+from inflate.scrapers.scraper import Checkpoint
+from inflate.utils import logger
+
+
+def snapshot_path(datastore: Path, name: str) -> Path:
+    path = datastore / name / datetime.now().strftime(DATE_FMT)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def dump_collection(
+    collection: Collection,
+    datastore: Path,
+    *,
+    compress: bool = False,
+    file_format: str = "json",
+) -> Path:
+    path = snapshot_path(datastore, collection.name)
+
+    if file_format == "columnar":
+        path = path.with_suffix(SUFFIX)
+        dump_columnar(collection, str(path), compress=compress)
+        return path
+
+    if compress:
+        path = path.with_suffix(".json.gz")
+        manager = gzip.open(path, "wt")
+    else:
+        path = path.with_suffix(".json")
+        manager = open(path, "wt")
+
+    with manager as file:
+        json.dump(collection.dump(), file, ensure_ascii=False)
+    return path
+
+
+def write_snapshot(
+    scraper: Scraper,
+    datastore: Path,
+    *,
+    compress: bool = False,
+    resume: bool = False,
+) -> Path:
+    """Write the pages of the given scraper to the datastore as soon as
+    they are scraped. If resume is set, continue from the journal of the
+    last interrupted scrape (if there is one)."""
+    name = scraper.CONFIG["name"]
+    if resume and (journal_path := find_journal(datastore, name)):
+        writer = SnapshotWriter.resume(journal_path, compress=compress)
+        logger.info(
+            f"Resuming {name!r} from {journal_path}, with"
+            f" {len(writer.completed)} completed pages"
+        )
+    else:
+        writer = SnapshotWriter(
+            snapshot_path(datastore, name), name, compress=compress
+        )
+
+    scraper.checkpoint = Checkpoint(
+        writer.completed, writer.page_counts, writer.states
+    )
+    with writer:
+        for page in scraper.pages():
+            writer.write(page.items)
+            if page.complete:
+                writer.checkpoint(
+                    page.category, page.page, page.page_count, page.state
+                )
+        writer.metadata = scraper.metadata
+    return writer.snapshot_path
+
+
+def recover_snapshots(
+    scrapers: Iterable[Type[Scraper]],
+    datastore: Path,
+    *,
+    compress: bool = False,
+) -> None:
+    """Turn the journals of the interrupted scrapes into snapshots, with
+    whatever items they had managed to write (instead of resuming them)."""
+    for scraper in scrapers:
+        name = scraper.CONFIG["name"]
+        if journal_path := find_journal(datastore, name):
+            path = SnapshotWriter.recover(journal_path, compress=compress)
+            logger.info(f"Recovered {path}")
+        else:
+            logger.info(f"No interrupted scrape to recover for {name!r}")
+
+
+def scrape_snapshot(scraper: Scraper, datastore: Path, **kwargs: Any) -> Path:
+    return dump_collection(scraper.scrape(), datastore, **kwargs)
+
+
+def load_previous_snapshot(datastore: Path, name: str) -> Optional[Collection]:
+    path = find_latest_snapshot(datastore, name)
+    if path is None:
+        return None
+    elif path.name.endswith(SUFFIX):
+        # The regular loader skips the metadata of the items, which
+        # needs to be carried over as well.
+        return load_columnar(str(path))
+    else:
+        return load_snapshot(path)
+
+
+def run_differential(
+    scraper: Scraper, *, runner: Callable[[Scraper], Path], datastore: Path
+) -> Path:
+    """Run the scraper against the last snapshot of its source, so that
+    the unchanged parts of the source are carried over from it."""
+    scraper.previous = load_previous_snapshot(
+        datastore, scraper.CONFIG["name"]
+    )
+    return runner(scraper)
+
+
+async def run_async(
+    scrapers: Iterable[Type[Scraper]],
+    datastore: Path,
+    *,
+    compress: bool = False,
+    file_format: str = "json",
+    max_host_concurrency: Optional[int] = None,
+) -> None:
+    collections = run_async_scrapers(
+        [
+            AVAILABLE_ASYNC_SCRAPERS[scraper.CONFIG["name"]]
+            for scraper in scrapers
+        ],
+        max_host_concurrency=max_host_concurrency or MAX_HOST_CONCURRENCY,
+    )
+    async for collection in collections:
+        dump_collection(
+            collection, datastore, compress=compress, file_format=file_format
+        )
+
+
+def run_sync(scrapers: List[Type[Scraper]], options: Namespace) -> None:
+    if options.workers is not None:
+        for scraper in scrapers:
+            scraper.CONFIG["workers"] = options.workers
+
+    runner: Callable[[Scraper], Path]
+    if options.format == "json":
+        runner = partial(
+            write_snapshot,
+            datastore=options.datastore,
+            compress=options.compress,
+            resume=options.resume,
+        )
+    else:
+        runner = partial(
+            scrape_snapshot,
+            datastore=options.datastore,
+            compress=options.compress,
+            file_format=options.format,
+        )
+
+    if options.differential:
+        runner = partial(
+            run_differential, runner=runner, datastore=options.datastore
+        )
+
+    path: Path
+    for path in run_scrapers(
+        scrapers=scrapers, parallel=options.parallel, runner=runner
+    ):
+        logger.info(f"Saved {path}")
 
 
 def main(argv: Optional[List[str]] = None) -> None:
@@ -14,31 +198,55 @@ def main(argv: Optional[List[str]] = None) -> None:
     parser.add_argument("datastore", type=Path)
     parser.add_argument("--scraper", type=str, default=None)
     parser.add_argument("--compress", action="store_true", default=False)
+    parser.add_argument(
+        "--format", choices=["json", "columnar"], default="json"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--parallel", action="store_true", default=False)
+    parser.add_argument("--pool-size", type=int, default=None)
+    parser.add_argument(
+        "--async", dest="use_async", action="store_true", default=False
+    )
+    parser.add_argument("--resume", action="store_true", default=False)
+    parser.add_argument("--recover", action="store_true", default=False)
+    parser.add_argument("--differential", action="store_true", default=False)
+    parser.add_argument("--metrics", type=Path, default=None)
 
     options = parser.parse_args()
+    if options.resume and (options.use_async or options.format != "json"):
+        parser.error("--resume is only supported for synchronous JSON scrapes")
+    if options.recover and options.resume:
+        parser.error("--recover and --resume can't be used together")
+    if options.differential and options.use_async:
+        parser.error("--differential is not supported for async scrapes")
 
     if options.scraper:
         scrapers = [AVAILABLE_SCRAPERS[options.scraper.casefold()]]
     else:
         scrapers = list(AVAILABLE_SCRAPERS.values())
 
-    collections = run_scrapers(scrapers=scrapers)
+    if options.pool_size is not None:
+        configure_session_pool(pool_maxsize=options.pool_size)
 
-    for collection in collections:
-        path = (
-            options.datastore
-            / collection.name
-            / datetime.now().strftime(DATE_FMT)
+    if options.recover:
+        recover_snapshots(
+            scrapers, options.datastore, compress=options.compress
         )
-        path.parent.mkdir(parents=True, exist_ok=True)
-
-        if options.compress:
-            manager = gzip.open(path.with_suffix(".json.gz"), "wt")
-        else:
-            manager = open(path.with_suffix(".json"), "wt")
+    elif options.use_async:
+        asyncio.run(
+            run_async(
+                scrapers,
+                options.datastore,
+                compress=options.compress,
+                file_format=options.format,
+                max_host_concurrency=options.workers,
+            )
+        )
+    else:
+        run_sync(scrapers, options)
 
-        with manager as file:
-            json.dump(collection.dump(), file, ensure_ascii=False)
+    if options.metrics is not None:
+        metrics.export(options.metrics)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,17 @@
+import inspect
 import logging
 import os
+import threading
 from collections import deque
-from functools import partial, wraps
+from functools import wraps
+from pathlib import Path
 
 from rich.progress import track
 
 PRODUCTION = os.getenv("PRODUCTION")
+CACHE_DIR = Path(
+    os.getenv("INFLATE_CACHE_DIR", Path.home() / ".cache" / "inflate")
+)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -16,6 +22,18 @@ logger.setLevel(logging.DEBUG)
 
 def robust(default):
     def outer(func):
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    logger.exception("Error while processing function")
+                    return default
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             try:
@@ -33,4 +51,10 @@ def exhaust(iterable):
     return deque(iterable, maxlen=0)
 
 
-progress = partial(track, transient=True, description="Scraping")
+def progress(sequence, description="Scraping", **kwargs):
+    # Rich can only render one live display at a time, so the
+    # scrapers that are running in the background stay silent.
+    if threading.current_thread() is not threading.main_thread():
+        return sequence
+
+    return track(sequence, transient=True, description=description, **kwargs)
@@ -0,0 +1,220 @@
+"""Price volatility statistics of every product, computed in a single
+batched pass over the price matrices.
+
+- cv: the mean coefficient of variation of the rolling windows
+- drawdown: the largest fall from a previous peak (as a fraction)
+- run_up: the largest rise from a previous trough (as a fraction)
+- frequency: the ratio of the price changes to the observed days
+- magnitude: the mean relative size of the price changes"""
+
+from __future__ import annotations
+
+import datetime
+import heapq
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Dict, Iterable, List, Literal, Optional, Tuple
+
+import numpy as np
+
+from inflate.format import RawProduct
+from inflate.matrix import MAX_GAP, PriceMatrix, forward_fill, group_sum
+
+Metric = Literal["cv", "drawdown", "run_up", "frequency", "magnitude"]
+
+METRICS: Tuple[Metric, ...] = (
+    "cv",
+    "drawdown",
+    "run_up",
+    "frequency",
+    "magnitude",
+)
+DEFAULT_WINDOW = 30
+
+
+def windowed_sums(values: np.ndarray, window: int) -> np.ndarray:
+    """Sum each row over every rolling window of the given size."""
+    sums = np.zeros((values.shape[0], values.shape[1] + 1))
+    np.cumsum(values, axis=1, out=sums[:, 1:])
+    return sums[:, window:] - sums[:, :-window]
+
+
+def rolling_cv(prices: np.ndarray, window: int) -> np.ndarray:
+    """Return the mean coefficient of variation of each row's rolling
+    windows (the windows with fewer than 2 prices are skipped, and the
+    rows without any other windows get 0)."""
+    observed = ~np.isnan(prices)
+    counts = observed.sum(axis=1, keepdims=True)
+    # Center the prices on their mean, so that the variances don't lose
+    # their precision to the squares of the large prices.
+    center = np.where(observed, prices, 0).sum(
+        axis=1, keepdims=True
+    ) / np.maximum(counts, 1)
+    centered = np.where(observed, prices - center, 0)
+
+    window = max(1, min(window, prices.shape[1]))
+    sizes = windowed_sums(observed.astype(np.float64), window)
+    sums = windowed_sums(centered, window)
+    squares = windowed_sums(centered * centered, window)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / sizes
+        deviations = np.sqrt(np.maximum(squares / sizes - means**2, 0))
+        cvs = deviations / (means + center)
+        valid = (sizes >= 2) & (means + center > 0)
+        return np.where(valid, cvs, 0).sum(axis=1) / np.maximum(
+            valid.sum(axis=1), 1
+        )
+
+
+@dataclass
+class ProductVolatility:
+    store: str
+    product: RawProduct
+    changes: int
+    cv: float
+    drawdown: float
+    run_up: float
+    frequency: float
+    magnitude: float
+
+
+@dataclass
+class Volatility:
+    """The volatility statistics of a single store, with an entry for
+    each product in each array (NaN for the products that are never
+    priced within the date range)."""
+
+    matrix: PriceMatrix
+    changes: np.ndarray
+    cv: np.ndarray
+    drawdown: np.ndarray
+    run_up: np.ndarray
+    frequency: np.ndarray
+    magnitude: np.ndarray
+
+    def __getitem__(self, row: int) -> ProductVolatility:
+        return ProductVolatility(
+            self.matrix.name,
+            self.matrix.products[row],
+            int(self.changes[row]),
+            *(float(getattr(self, metric)[row]) for metric in METRICS),
+        )
+
+    def aggregate(
+        self, *, by_category: bool = True, min_changes: int = 0
+    ) -> Dict[str, Dict[str, float]]:
+        """Return the mean of each metric per category (or for the whole
+        store, under its name), over the products that changed their
+        prices at least min_changes times."""
+        metrics = np.stack(
+            [getattr(self, metric) for metric in METRICS], axis=1
+        )
+        selected = (self.changes >= min_changes) & ~np.isnan(metrics).any(
+            axis=1
+        )
+
+        if by_category:
+            names, codes = self.matrix.categories
+        else:
+            names = [self.matrix.name]
+            codes = np.zeros(len(self.matrix.products), dtype=np.intp)
+
+        codes = codes[selected]
+        sums = group_sum(metrics[selected], codes, len(names))
+        counts = np.bincount(codes, minlength=len(names))
+        return {
+            names[code]: {
+                "products": int(counts[code]),
+                **dict(zip(METRICS, (sums[code] / counts[code]).tolist())),
+            }
+            for code in np.flatnonzero(counts)
+        }
+
+
+def compute_volatility(
+    matrix: PriceMatrix,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    *,
+    window: int = DEFAULT_WINDOW,
+    max_gap: int = MAX_GAP,
+) -> Volatility:
+    """Compute the volatility statistics of all the products of the
+    store within the date range, where the coefficients of variation are
+    taken over rolling windows of the given number of days. A missing
+    price is carried over for at most max_gap collections."""
+    columns = matrix.columns(start, end)
+    raw_prices = matrix.prices[:, columns]
+    prices = forward_fill(matrix.prices, limit=max_gap)[:, columns]
+    observed = ~np.isnan(prices)
+    seen = observed.any(axis=1)
+
+    previous, current = prices[:, :-1], raw_prices[:, 1:]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        changed = ~np.isnan(current) & ~np.isnan(previous)
+        changed &= current != previous
+        relative = np.where(changed, np.abs(current / previous - 1), 0)
+
+        peaks = np.fmax.accumulate(prices, axis=1)
+        troughs = np.fmin.accumulate(prices, axis=1)
+        drawdown = np.where(observed, 1 - prices / peaks, 0).max(
+            axis=1, initial=0
+        )
+        run_up = np.where(observed & (troughs > 0), prices / troughs - 1, 0)
+        run_up = run_up.max(axis=1, initial=0)
+
+    changes = changed.sum(axis=1)
+    observed_days = (~np.isnan(raw_prices)).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frequency = changes / np.maximum(observed_days - 1, 1)
+        magnitude = np.where(
+            changes > 0, relative.sum(axis=1) / np.maximum(changes, 1), 0
+        )
+
+    def unseen_as_nan(values: np.ndarray) -> np.ndarray:
+        return np.where(seen, values, np.nan)
+
+    return Volatility(
+        matrix,
+        changes,
+        unseen_as_nan(rolling_cv(prices, window)),
+        unseen_as_nan(drawdown),
+        unseen_as_nan(run_up),
+        unseen_as_nan(frequency),
+        unseen_as_nan(magnitude),
+    )
+
+
+def rank_volatility(
+    volatilities: Iterable[Volatility],
+    metric: Metric = "cv",
+    k: int = 50,
+    *,
+    min_changes: int = 1,
+) -> List[ProductVolatility]:
+    """Select the k most volatile products (by the given metric) across
+    all stores, among the ones that changed their prices at least
+    min_changes times."""
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+
+    candidates: List[Tuple[float, Volatility, int]] = []
+    for volatility in volatilities:
+        values = getattr(volatility, metric)
+        rows = np.flatnonzero(
+            (volatility.changes >= min_changes) & ~np.isnan(values)
+        )
+        if len(rows) > k:
+            rows = rows[np.argpartition(values[rows], -k)[-k:]]
+        candidates.extend(
+            (value, volatility, row)
+            for value, row in zip(values[rows].tolist(), rows.tolist())
+        )
+
+    return [
+        volatility[row]
+        for _, volatility, row in heapq.nlargest(
+            k, candidates, key=itemgetter(0)
+        )
+    ]
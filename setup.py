@@ -1,3 +1,9 @@
 from setuptools import find_packages, setup
 
-setup(name="inflate", version="0.0.1a0", packages=find_packages())
+setup(
+    name="inflate",
+    version="0.0.1a0",
+    packages=find_packages(
+        exclude=["benchmarks", "benchmarks.*", "tests", "tests.*"]
+    ),
+)